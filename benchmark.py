@@ -0,0 +1,238 @@
+"""
+Micro-benchmarks for the bot's hot paths.
+
+    python benchmark.py db pdf pdf-parallel zip album status
+"""
+import asyncio
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from blobs import BlobStore
+from convert import convert_to_pdf, create_zip
+from data import Database
+from debounce import Debouncer
+
+
+class PerCallDatabase(Database):
+    # The old behaviour: a fresh rollback-journal connection for every execute
+    @property
+    def connection(self):
+        return sqlite3.connect(self.path_to_db)
+
+
+def timed(func, repeat):
+    started = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return time.perf_counter() - started
+
+
+def bench_db(users=2000, lookups=20000):
+    print(f"SQLite: {users} inserts, {lookups} select_user lookups")
+    for label, cls in (("per-call connect", PerCallDatabase), ("persistent WAL", Database)):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = cls(path_to_db=os.path.join(tmp, "bench.db"))
+            insert = timed(lambda i: db.add_user(i, f"User {i}", f"user{i}"), users)
+            select = timed(lambda i: db.select_user(user_id=i % users), lookups)
+            db.close()
+            print(f"  {label:<18} insert {users / insert:>9.0f} ops/s   select {lookups / select:>9.0f} ops/s")
+
+
+def make_photos(directory, count, size=(1280, 960)):
+    # Telegram photos arrive as JPEGs with a 1280 px long edge; copies of one photo are enough here
+    from PIL import Image, ImageFilter
+
+    sample = os.path.join(directory, "sample.jpg")
+    Image.effect_noise(size, 64).convert("RGB").filter(ImageFilter.GaussianBlur(2)).save(sample, quality=85)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"photo_{i}.jpg")
+        shutil.copyfile(sample, path)
+        paths.append(path)
+    return paths
+
+
+def pillow_save_all(image_paths, output_file):
+    # The original convert_to_pdf
+    from PIL import Image
+
+    images = [Image.open(image_path) for image_path in image_paths]
+    images[0].save(output_file, save_all=True, append_images=images[1:])
+    for image in images:
+        image.close()
+
+
+def pdf_child(mode, directory):
+    # Runs in a fresh interpreter so ru_maxrss only covers one conversion
+    paths = sorted((os.path.join(directory, name) for name in os.listdir(directory) if name.startswith("photo_")),
+                   key=lambda path: int(path.rsplit("_", 1)[1].split(".")[0]))
+    output = os.path.join(directory, "out.pdf")
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    PDF_MODES[mode](paths, output)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{peak / 1024:.0f} {baseline / 1024:.0f} {elapsed:.2f} {os.path.getsize(output) / 2 ** 20:.1f}")
+
+
+PDF_MODES = {
+    "pillow save_all": pillow_save_all,
+    "streaming": lambda paths, output: convert_to_pdf(paths, output, passthrough=False),
+    "jpeg passthrough": convert_to_pdf,
+}
+
+
+def run_pdf_modes(title, modes, counts):
+    print(title)
+    for count in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            make_photos(tmp, count)
+            for mode in modes:
+                out = subprocess.run([sys.executable, __file__, "_pdf_child", mode, tmp],
+                                     capture_output=True, text=True, check=True).stdout.split()
+                peak, baseline, elapsed, size = out
+                print(f"  {count:>4} pages  {mode:<16} peak RSS {peak:>5} MB (at start {baseline} MB)  "
+                      f"{elapsed:>6} s  {count / float(elapsed):>6.0f} pages/s  {size:>6} MB")
+
+
+def bench_pdf(counts=(10, 100, 500)):
+    run_pdf_modes("PDF from 1280x960 JPEG photos", ["pillow save_all", "streaming", "jpeg passthrough"], counts)
+
+
+def bench_pdf_parallel(count=100, size=(4000, 3000)):
+    # Re-encoding work (the "medium" preset) on 12 MP photos, split across page workers
+    cores = os.cpu_count() or 1
+    print(f"PDF 'medium' preset from {count} {size[0]}x{size[1]} photos, {cores} CPU core(s)")
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_photos(tmp, count, size=size)
+        outputs = []
+        for workers in sorted({1, 2, 4, 8, cores}):
+            output = os.path.join(tmp, f"out_{workers}.pdf")
+            started = time.perf_counter()
+            convert_to_pdf(paths, output, quality=70, passthrough=False, max_edge=1600, dpi=150, workers=workers)
+            elapsed = time.perf_counter() - started
+            with open(output, "rb") as pdf:
+                outputs.append(pdf.read())
+            print(f"  workers={workers:<2} {elapsed:>6.2f} s  {count / elapsed:>6.1f} pages/s")
+        print(f"  outputs byte-identical: {all(output == outputs[0] for output in outputs)}")
+
+
+def make_documents(directory, count, size=4 * 2 ** 20):
+    # Log-like text compresses roughly like real documents, unlike random bytes
+    words = [f"{word}{i}" for i, word in enumerate(("invoice", "total", "status", "user", "error", "sum") * 50)]
+    line = " ".join(words).encode() + b"\n"
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"report_{i}.txt")
+        with open(path, "wb") as document:
+            document.write((line * (size // len(line) + 1))[:size])
+        paths.append(path)
+    return paths
+
+
+def zipfile_archive(compression):
+    # The original create_zip used zipfile with the default ZIP_STORED
+    def build(paths, output):
+        with zipfile.ZipFile(output, "w", compression) as archive:
+            for path in paths:
+                archive.write(path, os.path.basename(path))
+    return build
+
+
+def bench_zip(documents=16, photos=40):
+    cores = os.cpu_count() or 1
+    workers = max(cores, 4)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_documents(tmp, documents) + make_photos(tmp, photos)
+        total = sum(os.path.getsize(path) for path in paths) / 2 ** 20
+        print(f"ZIP of {documents} text files + {photos} JPEGs ({total:.0f} MB), {cores} CPU core(s)")
+        modes = {
+            "zipfile stored": zipfile_archive(zipfile.ZIP_STORED),
+            "zipfile deflated": zipfile_archive(zipfile.ZIP_DEFLATED),
+            "create_zip workers=1": lambda paths, output: create_zip(paths, output, workers=1),
+            f"create_zip workers={workers}": lambda paths, output: create_zip(paths, output, workers=workers),
+        }
+        for label, build in modes.items():
+            output = os.path.join(tmp, "out.zip")
+            started = time.perf_counter()
+            build(paths, output)
+            elapsed = time.perf_counter() - started
+            print(f"  {label:<22} {total / elapsed:>7.0f} MB/s  output {os.path.getsize(output) / 2 ** 20:>6.1f} MB")
+            os.remove(output)
+
+
+def simulated_download(latency, size):
+    # Stand-in for get_file + download_to_drive: a round trip, then the bytes hit the disk
+    async def download(path):
+        await asyncio.sleep(latency)
+        with open(path, "wb") as file:
+            file.write(os.urandom(size))
+    return download
+
+
+def bench_album(photos=10, latency=0.3, size=300 * 1024):
+    print(f"Album of {photos} photos, {latency * 1000:.0f} ms per download")
+
+    async def one_by_one(store):
+        # The old collect_files: every update waits for its own download
+        for index in range(photos):
+            await store.fetch(f"photo{index}", f"photo{index}.jpg", simulated_download(latency, size))
+
+    async def batched(store):
+        await asyncio.gather(*(store.fetch(f"photo{index}", f"photo{index}.jpg", simulated_download(latency, size))
+                               for index in range(photos)))
+
+    for label, run in (("one by one", one_by_one), ("album batch", batched)):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = BlobStore(root=tmp, max_downloads=8)
+            started = time.perf_counter()
+            asyncio.run(run(store))
+            print(f"  {label:<12} {time.perf_counter() - started:>6.2f} s")
+
+
+def bench_status(delay=1.0):
+    # (files, seconds between arrivals): an album's parts, a forwarded burst, a user sending slowly
+    bursts = ((10, 0.02), (50, 0.1), (20, 1.5))
+    print(f"Status edits per burst, {delay:.1f} s debounce window")
+
+    async def burst(files, interval):
+        debouncer = Debouncer(delay=delay)
+
+        async def edit():
+            pass
+
+        for _ in range(files):
+            debouncer.schedule("user", edit)
+            await asyncio.sleep(interval)
+        await asyncio.sleep(delay * 1.5)
+        return debouncer.requested, debouncer.calls
+
+    for files, interval in bursts:
+        requested, calls = asyncio.run(burst(files, interval))
+        print(f"  {files:>3} files every {interval * 1000:>4.0f} ms: {requested:>3} calls before, {calls:>3} now, "
+              f"{requested - calls} saved")
+
+
+BENCHMARKS = {
+    "db": bench_db,
+    "pdf": bench_pdf,
+    "pdf-parallel": bench_pdf_parallel,
+    "zip": bench_zip,
+    "album": bench_album,
+    "status": bench_status,
+}
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["_pdf_child"]:
+        pdf_child(sys.argv[2], sys.argv[3])
+        sys.exit()
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,242 @@
+import asyncio
+import itertools
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+
+class Blob:
+    def __init__(self, path: str, size: int, refs: int = 0, used: float = None):
+        self.path = path
+        self.size = size
+        self.refs = refs
+        # Wall-clock time of the last download or acquire, for age-based sweeping
+        self.used = used if used is not None else time.time()
+
+
+class BlobStore:
+    """
+    Content-addressed store of downloaded Telegram files keyed by file_unique_id.
+    Each blob lives in its own directory: documents/blobs/<file_unique_id>/<name>.
+    Sessions acquire a blob and release it when they are done with it; unreferenced blobs stay on
+    disk as a cache and are evicted least recently used first once the store exceeds `budget` bytes.
+    """
+
+    def __init__(self, root: str = "documents/blobs", budget: int = 2 * 1024 ** 3, max_downloads: int = 8):
+        self.root = root
+        self.budget = budget
+        self.max_downloads = max_downloads
+        # Downloads running or waiting for a slot, so callers can refuse work when saturated
+        self.queued = 0
+        # Created lazily so the store can be built before the event loop starts
+        self._downloads = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._blobs = OrderedDict()
+        self._by_path = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._tombstones = itertools.count()
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        # Blobs downloaded before a restart are kept as cache entries with no references. Only
+        # complete blobs are indexed; nothing is deleted here, since another process (or a worker
+        # importing this module) may be downloading into the same directory right now.
+        for unique_id in os.listdir(self.root):
+            directory = os.path.join(self.root, unique_id)
+            if not os.path.isdir(directory) or unique_id.endswith(".evicted"):
+                continue
+            names = os.listdir(directory)
+            if len(names) != 1 or names[0].endswith(".part"):
+                # Download in progress or interrupted; stale ones go in sweep_partial()
+                continue
+            path = os.path.join(directory, names[0])
+            stat = os.stat(path)
+            self._add(unique_id, path, stat.st_size, refs=0, used=stat.st_mtime)
+        # Oldest first, so the LRU order survives the restart
+        self._blobs = OrderedDict(sorted(self._blobs.items(), key=lambda item: item[1].used))
+        # No eviction here: restored sessions re-acquire their blobs first (see acquire_paths)
+
+    def _add(self, unique_id, path, size, refs, used=None):
+        self._blobs[unique_id] = Blob(path, size, refs, used)
+        self._by_path[path] = unique_id
+        self.size += size
+
+    def acquire(self, unique_id):
+        """
+        Take a reference to a cached blob. Returns its path, or None if it is not stored.
+        """
+        with self._lock:
+            blob = self._blobs.get(unique_id)
+            if blob is None:
+                return None
+            blob.refs += 1
+            blob.used = time.time()
+            self._blobs.move_to_end(unique_id)
+            return blob.path
+
+    async def fetch(self, unique_id: str, name: str, download) -> str:
+        """
+        Return a referenced path for the blob, calling `await download(path)` only on a miss.
+        Concurrent requests for the same file share one download; at most `max_downloads` run at once.
+        """
+        while True:
+            path = self.acquire(unique_id)
+            if path is not None:
+                self.hits += 1
+                return path
+            pending = self._pending.get(unique_id)
+            if pending is None:
+                break
+            # Someone else is downloading it; wait and try again (their download may have failed)
+            await asyncio.shield(pending)
+
+        self.misses += 1
+        directory = os.path.join(self.root, unique_id)
+        path = os.path.join(directory, os.path.basename(name))
+        pending = self._pending[unique_id] = asyncio.get_running_loop().create_future()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if self._downloads is None:
+                self._downloads = asyncio.Semaphore(self.max_downloads)
+            # Written under a temporary name so a crash never leaves a truncated blob behind
+            self.queued += 1
+            try:
+                async with self._downloads:
+                    await download(path + ".part")
+            finally:
+                self.queued -= 1
+            os.replace(path + ".part", path)
+            with self._lock:
+                self._add(unique_id, path, os.path.getsize(path), refs=1)
+                victims = self._evict()
+            self._remove(victims)
+            return path
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        finally:
+            del self._pending[unique_id]
+            pending.set_result(None)
+
+    def acquire_paths(self, paths):
+        """
+        Take a reference to each stored blob among `paths`. Returns the paths that are still stored.
+        """
+        acquired = []
+        for path, unique_id in zip(paths, self.unique_ids(paths)):
+            if unique_id is not None and self.acquire(unique_id) == path:
+                acquired.append(path)
+        return acquired
+
+    def release(self, paths):
+        """
+        Drop one reference per path. Paths that are not blobs are ignored.
+        """
+        with self._lock:
+            for path in paths:
+                unique_id = self._by_path.get(path)
+                if unique_id is not None and self._blobs[unique_id].refs > 0:
+                    self._blobs[unique_id].refs -= 1
+            victims = self._evict()
+        self._remove(victims)
+
+    def _evict(self, budget: int = None, used_before: float = None):
+        # Least recently used first, never a blob some session still holds. Called under the lock;
+        # victims are only renamed out of the way here and deleted by _remove() after it is released.
+        # Returns the evicted blobs.
+        budget = self.budget if budget is None else min(budget, self.budget)
+        victims = []
+        for unique_id in list(self._blobs):
+            blob = self._blobs[unique_id]
+            stale = used_before is not None and blob.used < used_before
+            if self.size <= budget and not stale:
+                # Blobs are in LRU order, so nothing later is stale either
+                break
+            if blob.refs:
+                continue
+            del self._blobs[unique_id]
+            del self._by_path[blob.path]
+            self.size -= blob.size
+            self.evictions += 1
+            # Renamed so a new download of the same file can't land in a directory being deleted
+            tombstone = f"{os.path.dirname(blob.path)}.{next(self._tombstones)}.evicted"
+            try:
+                os.rename(os.path.dirname(blob.path), tombstone)
+            except OSError as e:
+                logging.error(f"Failed to evict blob {unique_id}: {e}")
+                continue
+            victims.append((unique_id, tombstone, blob.size))
+        return victims
+
+    def _remove(self, victims) -> int:
+        # Deletes what _evict() set aside; returns bytes freed
+        freed = 0
+        for unique_id, tombstone, size in victims:
+            try:
+                shutil.rmtree(tombstone)
+                freed += size
+            except OSError as e:
+                logging.error(f"Failed to evict blob {unique_id}: {e}")
+        return freed
+
+    def sweep(self, budget: int = None, max_age: float = None) -> int:
+        """
+        Evict unreferenced blobs unused for `max_age` seconds, then more until the store fits `budget`.
+        Returns the number of bytes freed.
+        """
+        with self._lock:
+            victims = self._evict(budget, time.time() - max_age if max_age is not None else None)
+        return self._remove(victims)
+
+    def sweep_partial(self, max_age: float) -> int:
+        """
+        Remove directories that hold no indexed blob (interrupted downloads, evictions cut short by a
+        crash) and have not been written to for `max_age` seconds. Returns the number of bytes freed.
+        """
+        freed = 0
+        cutoff = time.time() - max_age
+        for unique_id in os.listdir(self.root):
+            with self._lock:
+                if unique_id in self._blobs or unique_id in self._pending:
+                    continue
+            path = os.path.join(self.root, unique_id)
+            try:
+                entries = [path] + ([os.path.join(path, name) for name in os.listdir(path)]
+                                    if os.path.isdir(path) else [])
+                stats = [os.stat(entry) for entry in entries]
+                if max(stat.st_mtime for stat in stats) > cutoff:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                freed += sum(stat.st_size for stat in stats[1:] or stats)
+            except OSError as e:
+                logging.error(f"Failed to remove partial blob {unique_id}: {e}")
+        return freed
+
+    def unique_ids(self, paths):
+        """
+        Map blob paths back to their file_unique_ids (None for paths that are not blobs).
+        """
+        with self._lock:
+            return [self._by_path.get(path) for path in paths]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "blobs": len(self._blobs),
+                "bytes": self.size,
+                "referenced": sum(1 for blob in self._blobs.values() if blob.refs),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
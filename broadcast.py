@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` sends per second with bursts up to `capacity`.
+    pause() stops every waiter until the given delay has passed (used for RetryAfter).
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # Created lazily so the bucket can be built before the event loop starts
+        self._lock = None
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        # Refill from the end of the pause, not across it, or the first acquire after it gets a full burst
+        self._updated = self._paused_until
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    # python-telegram-bot reports retry_after as int seconds or as a timedelta depending on version
+    delay = error.retry_after
+    if hasattr(delay, "total_seconds"):
+        delay = delay.total_seconds()
+    return float(delay)
+
+
+def message_content(message):
+    """
+    Describe an admin message as (kind, file_id, text) so a broadcast can be stored and resumed later.
+    """
+    if message.text:
+        return "text", None, message.text
+    if message.photo:
+        return "photo", message.photo[-1].file_id, message.caption
+    for kind in ("video", "document", "audio", "voice", "sticker"):
+        media = getattr(message, kind)
+        if media:
+            return kind, media.file_id, message.caption
+    return "copy", None, None
+
+
+async def send_content(bot, chat_id, job):
+    """
+    Re-send a stored broadcast message (a Broadcasts row) to one chat, in the broadcast priority class.
+    """
+    kind, file_id, text = job["kind"], job["file_id"], job["text"]
+    rate_limit_args = "broadcast"
+    if kind == "text":
+        await bot.send_message(chat_id=chat_id, text=text, rate_limit_args=rate_limit_args)
+    elif kind == "photo":
+        await bot.send_photo(chat_id=chat_id, photo=file_id, caption=text, rate_limit_args=rate_limit_args)
+    elif kind == "video":
+        await bot.send_video(chat_id=chat_id, video=file_id, caption=text, rate_limit_args=rate_limit_args)
+    elif kind == "document":
+        await bot.send_document(chat_id=chat_id, document=file_id, caption=text, rate_limit_args=rate_limit_args)
+    elif kind == "audio":
+        await bot.send_audio(chat_id=chat_id, audio=file_id, caption=text, rate_limit_args=rate_limit_args)
+    elif kind == "voice":
+        await bot.send_voice(chat_id=chat_id, voice=file_id, caption=text, rate_limit_args=rate_limit_args)
+    elif kind == "sticker":
+        await bot.send_sticker(chat_id=chat_id, sticker=file_id, rate_limit_args=rate_limit_args)
+    else:
+        await bot.copy_message(chat_id=chat_id, from_chat_id=job["from_chat_id"], message_id=job["message_id"],
+                               rate_limit_args=rate_limit_args)
+
+
+class BroadcastControl:
+    """
+    Pause/resume/cancel switch for one running broadcast job.
+    """
+
+    def __init__(self, status: str = "running"):
+        self.status = status
+        self._running = asyncio.Event()
+        if status != "paused":
+            self._running.set()
+
+    def pause(self):
+        if self.status == "running":
+            self.status = "paused"
+            self._running.clear()
+
+    def resume(self):
+        if self.status == "paused":
+            self.status = "running"
+            self._running.set()
+
+    def cancel(self):
+        self.status = "cancelled"
+        self._running.set()
+
+    async def wait_if_paused(self):
+        await self._running.wait()
+
+
+class Broadcaster:
+    """
+    Sends one message to many chats with bounded concurrency behind a shared TokenBucket.
+    """
+
+    def __init__(self, limiter: TokenBucket, concurrency: int = 20, max_retries: int = 3, sent: int = 0,
+                 failed: int = 0):
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        # Start from the persisted counters when resuming a job
+        self.sent = sent
+        self.failed = failed
+        # Chat ids per delivery outcome since the last take_outcomes() call
+        self.delivered = []
+        self.blocked = []
+
+    def take_outcomes(self):
+        delivered, blocked = self.delivered, self.blocked
+        self.delivered, self.blocked = [], []
+        return delivered, blocked
+
+    async def _deliver(self, send, chat_id) -> bool:
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            try:
+                await send(chat_id)
+                self.delivered.append(chat_id)
+                return True
+            except RetryAfter as e:
+                # Flood control applies to the whole bot, so every worker waits
+                delay = retry_after_seconds(e)
+                logging.warning(f"Broadcast flood limit, pausing for {delay} s")
+                self.limiter.pause(delay)
+            except (Forbidden, BadRequest) as e:
+                # Blocked the bot, deactivated or chat gone: skip this chat in future broadcasts
+                if isinstance(e, Forbidden) or "chat not found" in str(e).lower():
+                    self.blocked.append(chat_id)
+                print(f"Failed to send message to {chat_id}: {e}")
+                return False
+            except Exception as e:
+                print(f"Failed to send message to {chat_id}: {e}")
+                return False
+        return False
+
+    async def run(self, chat_ids, send, control=None):
+        """
+        Call `send(chat_id)` for every chat id and return (sent, failed).
+        With a BroadcastControl, workers wait while it is paused and stop once it is cancelled.
+        """
+        chat_ids = iter(chat_ids)
+
+        async def worker():
+            while True:
+                # Checked before taking the next chat, so a pause never drops one
+                if control is not None:
+                    await control.wait_if_paused()
+                    if control.status == "cancelled":
+                        return
+                chat_id = next(chat_ids, None)
+                if chat_id is None:
+                    return
+                if await self._deliver(send, chat_id):
+                    self.sent += 1
+                else:
+                    self.failed += 1
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return self.sent, self.failed
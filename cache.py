@@ -0,0 +1,46 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MembershipCache:
+    """
+    Size-bounded TTL cache of channel-membership results keyed by (user_id, chat_id).
+    Thread-safe so it can be shared by telebot worker threads as well as the asyncio bot.
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, chat_id):
+        key = (user_id, str(chat_id))
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, user_id, chat_id, value: bool):
+        key = (user_id, str(chat_id))
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user_id):
+        # Drop every cached channel result for the user (e.g. after pressing "Tekshirish")
+        with self._lock:
+            for key in [key for key in self._data if key[0] == user_id]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
@@ -8,3 +8,89 @@ ADMINS = [5391341271]
 # ]
 
 NOT_SUB_MESSAGE = "Quyidagi kanalga obuna bo'ling!"
+
+# Channel membership cache (seconds / max cached (user, channel) pairs)
+SUB_CACHE_TTL = 60
+SUB_CACHE_SIZE = 10000
+
+# Parallel get_chat_member checks across all required channels
+SUB_CHECK_CONCURRENCY = 5
+SUB_CHECK_TIMEOUT = 5
+
+# Admin broadcasts: messages per second, parallel sends, progress refresh (seconds)
+BROADCAST_RATE = 25
+BROADCAST_CONCURRENCY = 20
+BROADCAST_PROGRESS_INTERVAL = 5
+# Recipients per checkpoint of a broadcast job
+BROADCAST_BATCH_SIZE = 500
+# Blocked users are retried by a broadcast once their last failure is this many days old
+BROADCAST_REPROBE_DAYS = 30
+
+# JPEG quality of PDF pages that have to be re-encoded
+PDF_JPEG_QUALITY = 75
+
+# PDF/ZIP worker pool: "process" or "thread", worker count (None = CPU count),
+# jobs one user may have in flight, jobs queued or running in total
+CONVERT_POOL = "process"
+CONVERT_WORKERS = None
+CONVERT_JOBS_PER_USER = 1
+CONVERT_QUEUE_SIZE = 20
+
+# PDF quality presets offered next to "PDF yaratish":
+# label, max long edge in pixels (None = keep), JPEG quality, page DPI, embed JPEGs untouched
+PDF_PRESETS = {
+    'original': {'label': "PDF yaratish", 'max_edge': None, 'quality': PDF_JPEG_QUALITY, 'dpi': 72,
+                 'passthrough': True},
+    'medium': {'label': "🗜 O'rta", 'max_edge': 1600, 'quality': 70, 'dpi': 150, 'passthrough': False},
+    'small': {'label': "🗜 Kichik", 'max_edge': 1000, 'quality': 55, 'dpi': 120, 'passthrough': False},
+}
+# Threads that decode/encode the pages of one PDF in parallel (1 = sequential)
+PDF_PAGE_WORKERS = 4
+
+# ZIP: threads compressing members in parallel, zlib level for compressible members
+ZIP_WORKERS = 4
+ZIP_DEFLATE_LEVEL = 6
+# ZIPs up to this size are built in memory and uploaded without a temp file
+ZIP_SPOOL_MAX_SIZE = 20 * 1024 * 1024
+
+# Partial PDF/ZIP outputs of sessions idle longer than this (seconds) are discarded
+INCREMENTAL_BUILD_TTL = 30 * 60
+# Threads shared by all incremental builds, and how many builds may exist at once (more sessions
+# are converted from scratch when the button is pressed)
+INCREMENTAL_BUILD_WORKERS = 2
+INCREMENTAL_BUILD_LIMIT = 200
+
+# Downloaded Telegram files, shared between sessions by file_unique_id
+BLOB_STORE_DIR = "documents/blobs"
+# Unreferenced files are evicted (least recently used first) above this many bytes
+BLOB_STORE_BUDGET = 2 * 1024 ** 3
+# Files downloaded from Telegram at the same time (e.g. the photos of one album)
+DOWNLOAD_CONCURRENCY = 8
+# New files are refused with a "busy" reply while this many downloads are running or waiting
+DOWNLOAD_QUEUE_SIZE = 200
+# An album is handled once no new part has arrived for this many seconds
+ALBUM_COLLECT_DELAY = 1.0
+# "Files received" status edits are coalesced into one per user per this many seconds
+STATUS_UPDATE_DELAY = 1.0
+
+# Sessions (files sent but not yet converted): idle lifetime in seconds, how many are kept,
+# files and bytes per session, and whether they are stored in SQLite to survive a restart
+# (changes are written in one batch every SESSION_FLUSH_INTERVAL seconds)
+SESSION_TTL = 6 * 3600
+SESSION_MAX_COUNT = 10000
+SESSION_MAX_FILES = 100
+SESSION_MAX_BYTES = 200 * 1024 ** 2
+SESSION_PERSIST = True
+SESSION_FLUSH_INTERVAL = 5
+
+# Spool directory for downloads and conversion jobs, swept every SPOOL_SWEEP_INTERVAL seconds:
+# leftovers older than SPOOL_MAX_AGE are removed and cached files are evicted to stay under SPOOL_BUDGET
+SPOOL_DIR = "documents"
+SPOOL_BUDGET = 4 * 1024 ** 3
+SPOOL_MAX_AGE = 24 * 3600
+SPOOL_SWEEP_INTERVAL = 10 * 60
+
+# Outgoing Bot API requests per second, and the most each priority class may use of it.
+# Classes are listed from highest to lowest priority; keep BROADCAST_RATE within its share.
+API_RATE = 30
+API_RATE_SHARES = {'interactive': 1.0, 'conversion': 0.5, 'broadcast': 0.8}
@@ -0,0 +1,515 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+from PIL import Image
+
+
+class PdfWriter:
+    """
+    Minimal streaming PDF writer. Every page is a single full-page JPEG image that is
+    written to the output as soon as it is added, so memory is bounded by one page
+    no matter how many pages the document has.
+    """
+
+    def __init__(self, fileobj, dpi: int = 72):
+        self.file = fileobj
+        self.dpi = dpi
+        self._pos = 0
+        self._offsets = []  # byte offset of every object, object number = index + 1
+        self._page_ids = []
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        # The page tree is written last, when all its kids are known
+        self._pages_id = self._reserve()
+
+    def _write(self, data: bytes):
+        self.file.write(data)
+        self._pos += len(data)
+
+    def _reserve(self) -> int:
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def _write_object(self, obj_id: int, header: bytes, stream: bytes = None):
+        self._offsets[obj_id - 1] = self._pos
+        self._write(b"%d 0 obj\n" % obj_id + header)
+        if stream is not None:
+            self._write(b"\nstream\n")
+            self._write(stream)
+            self._write(b"\nendstream")
+        self._write(b"\nendobj\n")
+
+    def add_jpeg(self, data: bytes, width: int, height: int, mode: str = "RGB"):
+        """
+        Add a page showing already JPEG-encoded `data` of the given pixel size.
+        """
+        colorspace = b"/DeviceGray" if mode == "L" else b"/DeviceRGB"
+        page_width = width * 72 / self.dpi
+        page_height = height * 72 / self.dpi
+
+        image_id = self._reserve()
+        self._write_object(
+            image_id,
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8 "
+            b"/Filter /DCTDecode /Length %d >>" % (width, height, colorspace, len(data)),
+            data
+        )
+        content = b"q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q" % (page_width, page_height)
+        content_id = self._reserve()
+        self._write_object(content_id, b"<< /Length %d >>" % len(content), content)
+        page_id = self._reserve()
+        self._write_object(
+            page_id,
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] "
+            b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+            % (self._pages_id, page_width, page_height, image_id, content_id)
+        )
+        self._page_ids.append(page_id)
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self._page_ids)
+        self._write_object(
+            self._pages_id, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._page_ids))
+        )
+        catalog_id = self._reserve()
+        self._write_object(catalog_id, b"<< /Type /Catalog /Pages %d 0 R >>" % self._pages_id)
+
+        xref_offset = self._pos
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self._offsets) + 1))
+        for offset in self._offsets:
+            self._write(b"%010d 00000 n \n" % offset)
+        self._write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(self._offsets) + 1, catalog_id, xref_offset)
+        )
+
+
+def prepare_page(path: str, quality: int = 75, passthrough: bool = True, max_edge: int = None):
+    """
+    Turn one image file into JPEG page data: (data, width, height, mode).
+    RGB and grayscale JPEGs are used as they are, without decoding; anything else (PNG with alpha,
+    WebP, CMYK JPEG, ...) is decoded and re-encoded. With `max_edge` set, larger images are
+    downscaled so their long edge fits it.
+    """
+    with Image.open(path) as image:
+        # Image.open only parses the header, so these checks do not decode any pixels
+        downscale = max_edge and max(image.size) > max_edge
+        if passthrough and not downscale and image.format == "JPEG" and image.mode in ("RGB", "L"):
+            width, height, mode = image.width, image.height, image.mode
+        elif downscale:
+            return encode_page(downscale_image(image, max_edge), quality)
+        else:
+            return encode_page(image, quality)
+    with open(path, "rb") as jpeg:
+        return jpeg.read(), width, height, mode
+
+
+def downscale_image(image: Image.Image, max_edge: int) -> Image.Image:
+    """
+    Shrink an image so its long edge is at most `max_edge` pixels.
+    JPEGs are decoded straight at a reduced scale (1/2, 1/4 or 1/8), so a 12 MP photo
+    is never decoded at full resolution.
+    """
+    scale = max_edge / max(image.size)
+    target = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    image.draft(None, target)
+    image = image.copy() if image.size == target else image.resize(target, Image.LANCZOS)
+    return image
+
+
+def encode_page(image: Image.Image, quality: int = 75):
+    """
+    Encode a Pillow image as a baseline JPEG page. Returns (data, width, height, mode).
+    """
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        # Flatten transparency onto white, like a printed page
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue(), image.width, image.height, image.mode
+
+
+# Job and build directories in use by this process; the spool sweeper never touches them
+live_dirs = set()
+
+
+@contextmanager
+def workspace(root: str = "documents/jobs"):
+    """
+    Private directory for one conversion job, removed afterwards whether the job
+    succeeded, failed or was cancelled.
+    """
+    os.makedirs(root, exist_ok=True)
+    path = tempfile.mkdtemp(prefix="job-", dir=root)
+    live_dirs.add(path)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+        live_dirs.discard(path)
+
+
+@contextmanager
+def atomic_output(output_file: str):
+    """
+    Write to a temporary name next to `output_file` and rename it into place only on success.
+    """
+    partial = output_file + ".part"
+    try:
+        yield partial
+        os.replace(partial, output_file)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def ordered_map(func, items, workers: int = 1, **kwargs):
+    """
+    Yield func(item, **kwargs) for every item, in input order. With workers > 1 the calls run on
+    a thread pool, with at most 2 * workers results waiting to be consumed.
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item, **kwargs)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item, **kwargs))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def convert_to_pdf(image_paths, output_file, quality: int = 75, passthrough: bool = True, max_edge: int = None,
+                   dpi: int = 72, workers: int = 1):
+    # Pages are written one at a time, in input order, to keep memory flat
+    with atomic_output(output_file) as partial, open(partial, 'wb') as pdf:
+        writer = PdfWriter(pdf, dpi=dpi)
+        # Pillow releases the GIL while decoding/encoding, so page threads run in parallel
+        for page in ordered_map(prepare_page, image_paths, workers=workers, quality=quality,
+                                passthrough=passthrough, max_edge=max_edge):
+            writer.add_jpeg(*page)
+        writer.close()
+    return output_file
+
+
+# Already-compressed formats: deflating them costs CPU and saves nothing.
+# OOXML/ODF office documents and APKs are ZIP containers themselves.
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp4', '.mkv', '.mov', '.avi', '.webm', '.mp3', '.m4a',
+    '.ogg', '.oga', '.opus', '.zip', '.rar', '.7z', '.gz', '.bz2', '.xz', '.pdf', '.docx', '.xlsx', '.pptx',
+    '.odt', '.ods', '.odp', '.apk', '.jar',
+}
+
+CHUNK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+# Written in the classic 32-bit fields when the real value lives in the ZIP64 extra field
+ZIP64_MARKER = 0xFFFFFFFF
+
+
+class ZipMember:
+    """
+    One archive member with its CRC and sizes already known, so it can be written in a single pass.
+    `data` is None for stored members (copied from `path`), or a file object holding the deflated bytes.
+    """
+
+    def __init__(self, path, arcname, method, crc, size, compressed_size, data=None):
+        self.path = path
+        self.arcname = arcname
+        self.method = method
+        self.crc = crc
+        self.size = size
+        self.compressed_size = compressed_size
+        self.data = data
+        self.date_time = dos_date_time(os.path.getmtime(path))
+
+
+def dos_date_time(timestamp):
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    if year < 1980:
+        return 0, (1 << 5) | 1
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def prepare_member(path, arcname=None, level: int = 6, spool_size: int = 8 * 1024 * 1024):
+    """
+    Read one file, computing its CRC and, for compressible types, its deflated bytes.
+    Deflated data is kept in a spooled temp file, so big members spill to disk instead of memory.
+    """
+    arcname = arcname or os.path.basename(path)
+    compress = os.path.splitext(path)[1].lower() not in STORED_EXTENSIONS
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if compress else None
+    data = tempfile.SpooledTemporaryFile(max_size=spool_size) if compress else None
+    crc = size = 0
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            if compress:
+                data.write(compressor.compress(chunk))
+    if compress:
+        data.write(compressor.flush())
+        if data.tell() < size:
+            return ZipMember(path, arcname, ZIP_DEFLATED, crc, size, data.tell(), data)
+        # Did not shrink: store it instead
+        data.close()
+    return ZipMember(path, arcname, ZIP_STORED, crc, size, size)
+
+
+class ZipWriter:
+    """
+    Sequential ZIP writer for members prepared by prepare_member(). It never seeks, so the
+    output may be any writable stream. ZIP64 records are added when sizes, offsets or the
+    member count exceed the classic format's limits.
+    """
+
+    def __init__(self, fileobj):
+        self.file = fileobj
+        self._pos = 0
+        self._entries = []
+
+    def _write(self, data: bytes):
+        self.file.write(data)
+        self._pos += len(data)
+
+    def add(self, member: ZipMember):
+        name = member.arcname.encode('utf-8')
+        offset = self._pos
+        zip64 = member.size >= ZIP64_LIMIT or member.compressed_size >= ZIP64_LIMIT
+        extra = struct.pack('<HHQQ', 1, 16, member.size, member.compressed_size) if zip64 else b''
+        self._write(struct.pack(
+            '<4sHHHHHLLLHH', b'PK\x03\x04', 45 if zip64 else 20, 0x800, member.method, *member.date_time,
+            member.crc, ZIP64_MARKER if zip64 else member.compressed_size, ZIP64_MARKER if zip64 else member.size,
+            len(name), len(extra)
+        ))
+        self._write(name + extra)
+
+        if member.data is None:
+            with open(member.path, 'rb') as source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    self._write(chunk)
+        else:
+            member.data.seek(0)
+            for chunk in iter(lambda: member.data.read(CHUNK_SIZE), b''):
+                self._write(chunk)
+            member.data.close()
+        self._entries.append((member, name, offset))
+
+    def close(self):
+        cd_offset = self._pos
+        for member, name, offset in self._entries:
+            fields = []
+            size, compressed_size, header_offset = member.size, member.compressed_size, offset
+            if size >= ZIP64_LIMIT:
+                fields.append(size)
+                size = ZIP64_MARKER
+            if compressed_size >= ZIP64_LIMIT:
+                fields.append(compressed_size)
+                compressed_size = ZIP64_MARKER
+            if header_offset >= ZIP64_LIMIT:
+                fields.append(header_offset)
+                header_offset = ZIP64_MARKER
+            extra = struct.pack('<HH', 1, 8 * len(fields)) + struct.pack(f'<{len(fields)}Q', *fields) if fields else b''
+            version = 45 if fields else 20
+            # Made by Unix (3), regular file with rw-r--r-- permissions
+            self._write(struct.pack(
+                '<4sHHHHHHLLLHHHHHLL', b'PK\x01\x02', (3 << 8) | 45, version, 0x800, member.method,
+                *member.date_time, member.crc, compressed_size, size, len(name), len(extra), 0, 0, 0,
+                (0o100644 << 16), header_offset
+            ))
+            self._write(name + extra)
+        cd_size = self._pos - cd_offset
+        count = len(self._entries)
+
+        if count >= 0xFFFF or cd_size >= ZIP64_LIMIT or cd_offset >= ZIP64_LIMIT:
+            eocd64_offset = self._pos
+            self._write(struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count, cd_size,
+                                    cd_offset))
+            self._write(struct.pack('<4sLQL', b'PK\x06\x07', 0, eocd64_offset, 1))
+        self._write(struct.pack(
+            '<4sHHHHLLH', b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(cd_size, ZIP64_MARKER), min(cd_offset, ZIP64_MARKER), 0
+        ))
+
+
+def write_zip(user_files, fileobj, workers: int = 1, level: int = 6):
+    """
+    Stream a ZIP of `user_files` into any writable file object. The sources are left alone;
+    they belong to the blob store.
+    """
+    writer = ZipWriter(fileobj)
+    # zlib releases the GIL, so members are compressed in parallel and written in order
+    for member in ordered_map(prepare_member, user_files, workers=workers, level=level):
+        writer.add(member)
+    writer.close()
+    return fileobj
+
+
+def create_zip(user_files, zip_filename, workers: int = 1, level: int = 6):
+    with atomic_output(zip_filename) as partial, open(partial, 'wb') as archive:
+        write_zip(user_files, archive, workers=workers, level=level)
+    return zip_filename
+
+
+class IncrementalBuild:
+    """
+    Partial PDF and ZIP outputs built in the background while a user's files are still arriving.
+    Additions run in arrival order on a shared `executor` (several builds progress in parallel, but
+    the steps of one build never overlap), so pressing a button only has to close the file.
+    Photos go into both outputs, documents only into the ZIP. The .part files are only open while a
+    step writes to them, so an idle build holds no file handles or threads.
+    """
+
+    # Builds created and not yet discarded, so callers can cap how many exist at once
+    live = 0
+    _live_lock = threading.Lock()
+
+    def __init__(self, executor, root: str = "documents/jobs", quality: int = 75, level: int = 6):
+        os.makedirs(root, exist_ok=True)
+        self.dir = tempfile.mkdtemp(prefix="build-", dir=root)
+        live_dirs.add(self.dir)
+        with IncrementalBuild._live_lock:
+            IncrementalBuild.live += 1
+        self.quality = quality
+        self.level = level
+        self.images = []
+        self.files = []
+        self.error = None
+        self.discarded = False
+        self.updated = time.monotonic()
+        self._executor = executor
+        self._steps = deque()
+        self._running = False
+        self._lock = threading.Lock()
+        self._pdf_path = os.path.join(self.dir, "images.pdf.part")
+        self._zip_path = os.path.join(self.dir, "ZipFile.zip.part")
+        with open(self._pdf_path, "wb") as pdf:
+            self._pdf = PdfWriter(pdf)
+        self._zip = ZipWriter(None)
+
+    def _submit(self, func, *args) -> Future:
+        self.updated = time.monotonic()
+        future = Future()
+        with self._lock:
+            self._steps.append((future, func, args))
+            if self._running:
+                return future
+            self._running = True
+        self._executor.submit(self._drain)
+        return future
+
+    def _drain(self):
+        # Runs this build's queued steps in order, then gives the worker back to other builds
+        while True:
+            with self._lock:
+                if not self._steps:
+                    self._running = False
+                    return
+                future, func, args = self._steps.popleft()
+            if future.set_running_or_notify_cancel():
+                self._guarded(func, *args)
+                future.set_result(None)
+
+    def _guarded(self, func, *args):
+        # After the first failure the partial outputs are unusable; later steps become no-ops
+        if self.error is not None or self.discarded:
+            return
+        try:
+            func(*args)
+        except Exception as e:
+            logging.error(f"Incremental build failed: {e}")
+            self.error = e
+
+    @staticmethod
+    def _append(writer, path, step, *args):
+        with open(path, "ab") as fileobj:
+            writer.file = fileobj
+            try:
+                step(*args)
+            finally:
+                writer.file = None
+
+    def _add_image(self, path):
+        self._append(self._pdf, self._pdf_path, self._pdf.add_jpeg, *prepare_page(path, quality=self.quality))
+        self._append(self._zip, self._zip_path, self._zip.add, prepare_member(path, level=self.level))
+
+    def _add_document(self, path):
+        self._append(self._zip, self._zip_path, self._zip.add, prepare_member(path, level=self.level))
+
+    def add_image(self, path):
+        self.images.append(path)
+        self.files.append(path)
+        return self._submit(self._add_image, path)
+
+    def add_document(self, path):
+        self.files.append(path)
+        return self._submit(self._add_document, path)
+
+    def covers_pdf(self, image_paths) -> bool:
+        return self.error is None and self.images == list(image_paths)
+
+    def covers_zip(self, file_paths) -> bool:
+        return self.error is None and sorted(self.files) == sorted(file_paths)
+
+    def _finish(self, writer, path):
+        self._submit(lambda: None).result()
+        if self.error is not None:
+            raise self.error
+        self._append(writer, path, writer.close)
+        output = path[:-len(".part")]
+        os.replace(path, output)
+        return output
+
+    def finish_pdf(self) -> str:
+        """
+        Wait for pending pages and finalise the PDF. Returns its path inside the build directory.
+        """
+        return self._finish(self._pdf, self._pdf_path)
+
+    def finish_zip(self) -> str:
+        return self._finish(self._zip, self._zip_path)
+
+    def discard(self):
+        """
+        Drop the partial outputs (the session was converted another way or abandoned).
+        """
+        if self.discarded:
+            return
+        # Steps still queued become no-ops; wait for the one that may be running
+        self.discarded = True
+        self._submit(lambda: None).result()
+        shutil.rmtree(self.dir, ignore_errors=True)
+        live_dirs.discard(self.dir)
+        with IncrementalBuild._live_lock:
+            IncrementalBuild.live -= 1
+
+
+def output_digest(kind: str, unique_ids, options: dict = None) -> str:
+    """
+    Identify a conversion by its output kind, ordered input file_unique_ids and options.
+    Equal digests produce equivalent files, so a previously uploaded output can be reused.
+    """
+    key = json.dumps([kind, list(unique_ids), options or {}], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
@@ -1,16 +1,68 @@
+import asyncio
+import functools
 import logging
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 class Database:
-    def __init__(self, path_to_db="main.db"):
+    def __init__(self, path_to_db="main.db", busy_timeout: float = 5.0, synchronous: str = "NORMAL",
+                 channels_check_interval: float = 5.0):
         self.path_to_db = path_to_db
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        # One long-lived connection per thread; close() may run from any thread
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # In-memory snapshot of the Channels table, dropped by the channel write methods. Changes made
+        # by the other bot process show up in ChannelsMeta.version, checked every channels_check_interval s
+        self._channels = None
+        self._channels_meta = None
+        self._channels_checked = 0.0
+        self._channels_lock = threading.Lock()
+        self.channels_check_interval = channels_check_interval
+        self.channels_version = 0
         self.create_table_users()
         self.create_table_status()
         self.create_table_channels()  # Create the channels table
+        self.create_table_broadcasts()
+        self.create_table_outputs()
+        self.create_table_sessions()
 
     @property
     def connection(self):
-        return sqlite3.connect(self.path_to_db)
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path_to_db, timeout=self.busy_timeout, check_same_thread=False)
+            # WAL lets main.py and mybot.py read while the other one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+            self._local.connection = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """
+        Close every connection opened by this instance.
+        """
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to close connection: {e}")
+        self._local = threading.local()
+
+    def checkpoint(self):
+        """
+        Fold the WAL back into the main database file (e.g. before sending it as a backup).
+        """
+        self.execute("PRAGMA wal_checkpoint(TRUNCATE);", fetchone=True)
 
     def execute(self, sql: str, parameters: tuple = None, fetchone=False, fetchall=False, commit=False):
         if not parameters:
@@ -39,6 +91,16 @@ class Database:
         );
         """
         self.execute(sql, commit=True)
+        self.migrate_users_delivery_status()
+
+    def migrate_users_delivery_status(self):
+        # status is 'active' or 'blocked'; status_updated_at is a unix timestamp of the last send outcome
+        columns = [row[1] for row in self.execute("PRAGMA table_info(Users);", fetchall=True)]
+        if "status" not in columns:
+            self.execute("ALTER TABLE Users ADD COLUMN status TEXT NOT NULL DEFAULT 'active';", commit=True)
+        if "status_updated_at" not in columns:
+            self.execute("ALTER TABLE Users ADD COLUMN status_updated_at INTEGER NOT NULL DEFAULT 0;", commit=True)
+        self.execute("CREATE INDEX IF NOT EXISTS idx_users_status ON Users (status, user_id);", commit=True)
 
     def create_table_status(self):
         sql = """
@@ -59,10 +121,87 @@ class Database:
         );
         """
         self.execute(sql, commit=True)
+        # One-row version that only channel writes change, whichever process makes them
+        self.execute("""
+        CREATE TABLE IF NOT EXISTS ChannelsMeta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+        """, commit=True)
+        self.execute("INSERT OR IGNORE INTO ChannelsMeta (id, version) VALUES (1, 0)", commit=True)
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            self.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS channels_{event.lower()} AFTER {event} ON Channels
+            BEGIN
+                UPDATE ChannelsMeta SET version = version + 1;
+            END;
+            """, commit=True)
+
+    def create_table_broadcasts(self):
+        # cursor is the last user_id whose delivery has been checkpointed (users are sent in user_id order)
+        sql = """
+        CREATE TABLE IF NOT EXISTS Broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            file_id TEXT,
+            text TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            progress_chat_id INTEGER,
+            progress_message_id INTEGER,
+            started_at TEXT NOT NULL,
+            finished_at TEXT
+        );
+        """
+        self.execute(sql, commit=True)
+
+    def create_table_outputs(self):
+        # digest identifies the ordered inputs and conversion options (see convert.output_digest)
+        sql = """
+        CREATE TABLE IF NOT EXISTS Outputs (
+            digest TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        );
+        """
+        self.execute(sql, commit=True)
+
+    def create_table_sessions(self):
+        # images/documents are JSON lists of file paths in arrival order
+        sql = """
+        CREATE TABLE IF NOT EXISTS Sessions (
+            user_id INTEGER PRIMARY KEY,
+            images TEXT NOT NULL,
+            documents TEXT NOT NULL,
+            status_message_id INTEGER,
+            updated_at INTEGER NOT NULL
+        );
+        """
+        self.execute(sql, commit=True)
 
     def drop_table_channels(self):
         sql = "DROP TABLE IF EXISTS Channels;"
         self.execute(sql, commit=True)
+        # The triggers go with the table
+        self.execute("UPDATE ChannelsMeta SET version = version + 1", commit=True)
+        self.invalidate_channels()
+
+    def invalidate_channels(self):
+        """
+        Forget the cached channel list so the next read goes to the database.
+        """
+        with self._channels_lock:
+            self._channels = None
+            self.channels_version += 1
+
+    def select_channels_meta_version(self):
+        return self.execute("SELECT version FROM ChannelsMeta", fetchone=True)[0]
 
     @staticmethod
     def format_args(sql, parameters: dict):
@@ -78,7 +217,7 @@ class Database:
 
     def select_all_users(self):
         sql = """
-        SELECT * FROM Users
+        SELECT user_id, full_name, username FROM Users
         """
         return self.execute(sql, fetchall=True)
 
@@ -116,6 +255,107 @@ class Database:
         sql = "UPDATE Status SET active = ?"
         self.execute(sql, parameters=(active,), commit=True)
 
+    def update_users_status(self, user_ids, status: str, updated_at: int):
+        if not user_ids:
+            return
+        placeholders = ", ".join("?" for _ in user_ids)
+        sql = f"UPDATE Users SET status = ?, status_updated_at = ? WHERE user_id IN ({placeholders})"
+        self.execute(sql, parameters=(status, updated_at, *user_ids), commit=True)
+
+    def count_users_by_status(self):
+        """
+        Return {status: count} using the (status, user_id) index.
+        """
+        sql = "SELECT status, COUNT(*) FROM Users GROUP BY status"
+        return dict(self.execute(sql, fetchall=True))
+
+    def select_user_ids_after(self, cursor: int, limit: int, reprobe_before: int = None):
+        """
+        Next broadcast recipients after `cursor`: live chats only, plus blocked users last checked
+        before `reprobe_before` (a unix timestamp) so they get re-probed now and then.
+        """
+        sql = """
+        SELECT user_id FROM Users
+        WHERE user_id > ? AND (status = 'active' OR (status = 'blocked' AND status_updated_at < ?))
+        ORDER BY user_id LIMIT ?
+        """
+        rows = self.execute(sql, parameters=(cursor, reprobe_before or 0, limit), fetchall=True)
+        return [row[0] for row in rows]
+
+    def count_users_to_broadcast(self, reprobe_before: int = None):
+        sql = """
+        SELECT COUNT(*) FROM Users
+        WHERE status = 'active' OR (status = 'blocked' AND status_updated_at < ?)
+        """
+        return self.execute(sql, parameters=(reprobe_before or 0,), fetchone=True)
+
+    BROADCAST_COLUMNS = (
+        "id", "from_chat_id", "message_id", "kind", "file_id", "text", "status", "cursor", "sent", "failed",
+        "total", "progress_chat_id", "progress_message_id", "started_at", "finished_at"
+    )
+
+    def add_broadcast(self, from_chat_id: int, message_id: int, kind: str, file_id: str, text: str, total: int,
+                      progress_chat_id: int, progress_message_id: int, started_at: str) -> int:
+        sql = """
+        INSERT INTO Broadcasts (from_chat_id, message_id, kind, file_id, text, total,
+                                progress_chat_id, progress_message_id, started_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        self.execute(sql, parameters=(from_chat_id, message_id, kind, file_id, text, total,
+                                      progress_chat_id, progress_message_id, started_at), commit=True)
+        return self.execute("SELECT last_insert_rowid()", fetchone=True)[0]
+
+    def select_broadcast(self, broadcast_id: int):
+        """
+        Return the broadcast job as a dict keyed by BROADCAST_COLUMNS, or None.
+        """
+        sql = f"SELECT {', '.join(self.BROADCAST_COLUMNS)} FROM Broadcasts WHERE id = ?"
+        row = self.execute(sql, parameters=(broadcast_id,), fetchone=True)
+        return dict(zip(self.BROADCAST_COLUMNS, row)) if row else None
+
+    def select_unfinished_broadcasts(self):
+        sql = f"SELECT {', '.join(self.BROADCAST_COLUMNS)} FROM Broadcasts WHERE status IN ('running', 'paused') ORDER BY id"
+        return [dict(zip(self.BROADCAST_COLUMNS, row)) for row in self.execute(sql, fetchall=True)]
+
+    def update_broadcast_checkpoint(self, broadcast_id: int, cursor: int, sent: int, failed: int):
+        sql = "UPDATE Broadcasts SET cursor = ?, sent = ?, failed = ? WHERE id = ?"
+        self.execute(sql, parameters=(cursor, sent, failed, broadcast_id), commit=True)
+
+    def update_broadcast_status(self, broadcast_id: int, status: str, finished_at: str = None):
+        sql = "UPDATE Broadcasts SET status = ?, finished_at = ? WHERE id = ?"
+        self.execute(sql, parameters=(status, finished_at, broadcast_id), commit=True)
+
+    def add_output(self, digest: str, kind: str, file_id: str, created_at: int):
+        sql = "INSERT OR REPLACE INTO Outputs (digest, kind, file_id, created_at) VALUES (?, ?, ?, ?)"
+        self.execute(sql, parameters=(digest, kind, file_id, created_at), commit=True)
+
+    def select_output_file_id(self, digest: str):
+        row = self.execute("SELECT file_id FROM Outputs WHERE digest = ?", parameters=(digest,), fetchone=True)
+        return row[0] if row else None
+
+    def delete_output(self, digest: str):
+        self.execute("DELETE FROM Outputs WHERE digest = ?", parameters=(digest,), commit=True)
+
+    def select_sessions(self):
+        sql = "SELECT user_id, images, documents, status_message_id, updated_at FROM Sessions"
+        return self.execute(sql, fetchall=True)
+
+    def save_sessions(self, rows, deleted):
+        """
+        Write (user_id, images, documents, status_message_id, updated_at) rows and delete the
+        sessions of `deleted` user_ids, all in one transaction.
+        """
+        try:
+            with self.connection as conn:
+                conn.executemany("""
+                INSERT OR REPLACE INTO Sessions (user_id, images, documents, status_message_id, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                """, rows)
+                conn.executemany("DELETE FROM Sessions WHERE user_id = ?", [(user_id,) for user_id in deleted])
+        except sqlite3.Error as e:
+            logging.error(f"SQLite error: {e}")
+            raise
+
     def add_channel(self, name: str, channel_id: str, link: str) -> bool:
         """
         Add a new channel to the database.
@@ -127,6 +367,8 @@ class Database:
         except sqlite3.Error as e:
             logging.error(f"Failed to add channel: {e}")
             return False
+        finally:
+            self.invalidate_channels()
 
     def select_all_channels(self):
         sql = """
@@ -156,6 +398,8 @@ class Database:
         except sqlite3.Error as e:
             logging.error(f"Failed to delete channel: {e}")
             return False
+        finally:
+            self.invalidate_channels()
 
     def is_subscribed(self, user_id: int, channel_url: str) -> bool:
         # Query the database to check if the user is subscribed to the given channel
@@ -169,13 +413,64 @@ class Database:
         """
         Fetch all channels from the database and return them as a list of tuples
         containing (channel name, channel ID, channel link).
+        The result is served from memory until a channel is added or deleted here, or (noticed within
+        channels_check_interval seconds) by another process; channels_version changes whenever the list does.
         """
+        with self._channels_lock:
+            channels, version, seen = self._channels, self.channels_version, self._channels_meta
+            now = time.monotonic()
+            if channels is not None and now - self._channels_checked < self.channels_check_interval:
+                return list(channels)
+            self._channels_checked = now
         try:
-            channels = self.select_all_channels()
-            return [(channel[1], channel[2], channel[3]) for channel in channels]
+            meta = self.select_channels_meta_version()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to check for channel changes: {e}")
+            meta = None
+        if channels is not None and (meta is None or meta == seen):
+            return list(channels)
+        try:
+            fresh = [(channel[1], channel[2], channel[3]) for channel in self.select_all_channels()]
         except sqlite3.Error as e:
             logging.error(f"Failed to fetch channels: {e}")
-            return []
+            return list(channels or [])
+        with self._channels_lock:
+            # A write in this process during the SELECT makes the result stale already; keep it
+            # for this caller only and let the next read fetch again
+            if self.channels_version == version:
+                if channels is not None and fresh != channels:
+                    self.channels_version += 1
+                self._channels = fresh
+                self._channels_meta = meta
+        return list(fresh)
+
+class AsyncDatabase:
+    """
+    Awaitable variant of Database with the same method surface.
+    Every call runs on a small thread pool, so SQLite I/O never blocks the event loop.
+    """
+
+    def __init__(self, db: Database = None, path_to_db="main.db", max_workers: int = 4):
+        self.db = db if db is not None else Database(path_to_db=path_to_db)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(attr, *args, **kwargs))
+
+        setattr(self, name, method)
+        return method
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+        self.db.close()
+
 
 # Configure logging
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+
+class Debouncer:
+    """
+    Coalesces bursts of updates per key: the first schedule() for a key starts a `delay` second
+    window, and only the latest callback scheduled within that window is awaited when it ends.
+    """
+
+    def __init__(self, delay: float = 1.0):
+        self.delay = delay
+        # Updates asked for vs. callbacks actually run, to see how much a burst saved
+        self.requested = 0
+        self.calls = 0
+        self._latest = {}
+        self._tasks = {}
+
+    def schedule(self, key, callback):
+        """
+        Run `await callback()` at the end of the key's current window (must be called from the event loop).
+        """
+        self.requested += 1
+        self._latest[key] = callback
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.ensure_future(self._run(key))
+
+    async def _run(self, key):
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self._tasks.pop(key, None)
+        callback = self._latest.pop(key, None)
+        if callback is None:
+            return
+        self.calls += 1
+        try:
+            await callback()
+        except Exception as e:
+            logging.error(f"Debounced update for {key} failed: {e}")
+
+    def cancel(self, key):
+        # Drop a pending update, e.g. because the session it describes was just converted
+        self._latest.pop(key, None)
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
@@ -0,0 +1,67 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+
+class JobRejected(Exception):
+    """
+    Raised when a conversion cannot be accepted right now.
+    `reason` is 'user' (the user already has jobs in flight) or 'busy' (the queue is full).
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class JobPool:
+    """
+    Runs blocking conversion steps (PDF/ZIP building) on a worker pool so the event loop stays free.
+    Limits how many jobs one user may have in flight and how many jobs may be queued or running in total.
+    """
+
+    def __init__(self, workers: int = None, kind: str = "process", per_user: int = 1, max_queue: int = 20):
+        if kind == "process":
+            # spawn: forking a process that already runs threads (db pool, asyncio) is not safe
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="convert")
+        # For steps whose result cannot cross a process boundary (e.g. an open spooled file)
+        self.thread_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="convert-io")
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.in_flight = {}
+        self.total = 0
+
+    @asynccontextmanager
+    async def job(self, user_id):
+        """
+        Reserve a job slot for the user or raise JobRejected straight away.
+        """
+        if self.in_flight.get(user_id, 0) >= self.per_user:
+            raise JobRejected("user")
+        if self.total >= self.max_queue:
+            raise JobRejected("busy")
+        self.in_flight[user_id] = self.in_flight.get(user_id, 0) + 1
+        self.total += 1
+        try:
+            yield self
+        finally:
+            self.total -= 1
+            self.in_flight[user_id] -= 1
+            if not self.in_flight[user_id]:
+                del self.in_flight[user_id]
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def run_in_thread(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        self.thread_executor.shutdown(wait=False)
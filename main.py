@@ -1,28 +1,103 @@
 import os
-import zipfile
-from PIL import Image
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from telegram import Update, File, InlineKeyboardMarkup, InlineKeyboardButton, InputFile
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackContext, \
     CallbackQueryHandler
+from telegram.error import BadRequest
 from config import *
-from data import Database
+from data import Database, AsyncDatabase
+from blobs import BlobStore
+from cache import MembershipCache
+from debounce import Debouncer
+from sessions import SessionStore
+from scheduler import PriorityRateLimiter
+from spool import SpoolCollector
+from convert import IncrementalBuild, convert_to_pdf, live_dirs, output_digest, workspace, write_zip
+from jobs import JobPool, JobRejected
+from broadcast import Broadcaster, BroadcastControl, TokenBucket, message_content, send_content
 import pytz
 import asyncio
 import logging
+import time
 from datetime import datetime
 import xlsxwriter as xl
 
-os.makedirs('documents', exist_ok=True)
+# Pending "files received" status edits, one per user per STATUS_UPDATE_DELAY window
+status_updates = Debouncer(delay=STATUS_UPDATE_DELAY)
+# Album messages still arriving: {(user_id, media_group_id): [Message]}
+pending_albums = {}
+# Broadcast jobs running in this process: {broadcast_id: BroadcastControl}
+broadcast_controls = {}
+# Broadcasts and sweepers, cancelled in post_stop
+background_tasks = set()
+
+# Stateful services, created by init(). Importing this module must have no side effects:
+# conversion workers are spawned processes that re-import it as __mp_main__.
+db = None
+adb = None
+blob_store = None
+spool = None
+membership_cache = None
+api_limiter = None
+broadcast_limiter = None
+job_pool = None
+build_executor = None
+sessions = None
+
+
+def release_session(user_id, session) -> None:
+    # An expired or evicted session gives its files back to the blob store and drops its partial outputs
+    status_updates.cancel(user_id)
+    blob_store.release(session.files)
+    build, session.build = session.build, None
+    if build is not None:
+        job_pool.thread_executor.submit(build.discard)
+
+
+def init() -> None:
+    global db, adb, blob_store, spool, membership_cache, api_limiter, broadcast_limiter, job_pool, build_executor, \
+        sessions
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+
+    db = Database(path_to_db="database.db")
+    # Awaitable view of the same database for the async handlers
+    adb = AsyncDatabase(db)
+    blob_store = BlobStore(root=BLOB_STORE_DIR, budget=BLOB_STORE_BUDGET, max_downloads=DOWNLOAD_CONCURRENCY)
+    # Cleans up whatever crashes and abandoned sessions leave in documents/
+    spool = SpoolCollector(SPOOL_DIR, blob_store, live_dirs, budget=SPOOL_BUDGET, max_age=SPOOL_MAX_AGE)
+    membership_cache = MembershipCache(ttl=SUB_CACHE_TTL, maxsize=SUB_CACHE_SIZE)
+    # Every outgoing request: replies first, then conversion results, then broadcasts
+    api_limiter = PriorityRateLimiter(rate=API_RATE, shares=API_RATE_SHARES)
+    # Shared by every broadcast so concurrent jobs together stay under Telegram's limit
+    broadcast_limiter = TokenBucket(rate=BROADCAST_RATE)
+    # PDF/ZIP building runs here instead of on the event loop
+    job_pool = JobPool(workers=CONVERT_WORKERS, kind=CONVERT_POOL, per_user=CONVERT_JOBS_PER_USER,
+                       max_queue=CONVERT_QUEUE_SIZE)
+    # Shared by every session's incremental build; one build's steps still run in order
+    build_executor = ThreadPoolExecutor(max_workers=INCREMENTAL_BUILD_WORKERS, thread_name_prefix="build")
+
+    # Files each user has sent since their last conversion
+    sessions = SessionStore(ttl=SESSION_TTL, max_sessions=SESSION_MAX_COUNT, max_files=SESSION_MAX_FILES,
+                            max_bytes=SESSION_MAX_BYTES, on_evict=release_session,
+                            db=db if SESSION_PERSIST else None)
+    for user_id, session in sessions.load():
+        # Hold the files again; any evicted while the bot was down are dropped from the session
+        session.images = blob_store.acquire_paths(session.images)
+        session.documents = blob_store.acquire_paths(session.documents)
 
-# Dictionary to keep track of user sessions and images
-user_images = {}
-user_documents = {}
-last_sent_message_id = {}
 
-db = Database(path_to_db="database.db")
+# CHECK SUBSCRIBE
 
+async def is_channel_member(context, chat_id, user_id) -> bool:
+    cached = membership_cache.get(user_id, chat_id)
+    if cached is not None:
+        return cached
+    member = await context.bot.get_chat_member(chat_id, user_id)
+    subscribed = member.status in ['member', 'administrator', 'creator']
+    membership_cache.set(user_id, chat_id, subscribed)
+    return subscribed
 
-# CHECK SUBSCRIBE
 
 async def check_sub_channels(db: Database, user_id, context, channel_index=None):
     channels = db.get_channels_from_db()  # Fetch channels from the database
@@ -35,11 +110,7 @@ async def check_sub_channels(db: Database, user_id, context, channel_index=None)
             channel = channels[channel_index]
             chat_id = channel[1]
             try:
-                member = await context.bot.get_chat_member(chat_id, user_id)
-                if member.status in ['member', 'administrator', 'creator']:
-                    return True
-                else:
-                    return False
+                return await is_channel_member(context, chat_id, user_id)
             except Exception as e:
                 logging.error(f"Failed to check subscription for channel {chat_id}: {e}")
                 return False
@@ -47,17 +118,30 @@ async def check_sub_channels(db: Database, user_id, context, channel_index=None)
             logging.error("Invalid channel index provided.")
             return False
 
-    # Check all channels if no specific index is provided
-    for index, channel in enumerate(channels):
+    # Check all channels concurrently if no specific index is provided
+    semaphore = asyncio.Semaphore(SUB_CHECK_CONCURRENCY)
+
+    async def check_channel(channel):
         chat_id = channel[1]
-        try:
-            member = await context.bot.get_chat_member(chat_id, user_id)
-            if member.status in ['member', 'administrator', 'creator']:
-                subscribed_channels.append((index, channel))
-            else:
-                not_subscribed_channels.append((index, channel))
-        except Exception as e:
-            logging.error(f"Failed to check subscription for channel {chat_id}: {e}")
+        async with semaphore:
+            try:
+                return await is_channel_member(context, chat_id, user_id)
+            except Exception as e:
+                logging.error(f"Failed to check subscription for channel {chat_id}: {e!r}")
+                return False
+
+    # One deadline for all of them, as in mybot; checks still running by then count as not subscribed
+    tasks = [asyncio.create_task(check_channel(channel)) for channel in channels]
+    if tasks:
+        await asyncio.wait(tasks, timeout=SUB_CHECK_TIMEOUT)
+    for index, (channel, task) in enumerate(zip(channels, tasks)):
+        if not task.done():
+            task.cancel()
+            logging.error(f"Subscription check for channel {channel[1]} timed out")
+            not_subscribed_channels.append((index, channel))
+        elif task.result():
+            subscribed_channels.append((index, channel))
+        else:
             not_subscribed_channels.append((index, channel))
 
     # If subscribed to all channels
@@ -106,6 +190,9 @@ async def handle_callback_query(update: Update, context: CallbackContext):
     data = query.data
     chat_id = query.from_user.id
 
+    if data.startswith("subchanneldone"):
+        membership_cache.invalidate(chat_id)
+
     if data == "subchanneldone":
         subscribed = await check_sub_channels(db, chat_id, context)
         await query.answer("Tekshirish amalga oshirildi.")
@@ -122,8 +209,7 @@ async def handle_callback_query(update: Update, context: CallbackContext):
         chat_id = channel[1]
 
         try:
-            member = await context.bot.get_chat_member(chat_id, query.from_user.id)
-            if member.status in ['member', 'administrator', 'creator']:
+            if await is_channel_member(context, chat_id, query.from_user.id):
                 button_text = f"{channel[0]} ✅"
             else:
                 button_text = f"{channel[0]} ❌"
@@ -143,6 +229,9 @@ async def sub_channel_done(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     user = query.from_user
 
+    # The user pressed "Tekshirish", so re-check every channel against the API
+    membership_cache.invalidate(user.id)
+
     # Check subscription status
     is_subscribed = await check_sub_channels(db, user.id, context)
 
@@ -162,9 +251,20 @@ async def sub_channel_done(update: Update, context: CallbackContext) -> None:
         )
 
 
+# (channels_version, markup) of the last keyboard built by show_channels
+_channels_markup = (None, None)
+
+
 def show_channels(db: Database) -> InlineKeyboardMarkup:
+    global _channels_markup
+    # Also picks up channels changed by the other process, bumping channels_version
+    channels = db.get_channels_from_db()
+    version = db.channels_version
+    cached_version, markup = _channels_markup
+    if cached_version == version:
+        return markup
+
     inline_keyboard = []
-    channels = db.get_channels_from_db()  # Fetch channels from the database
     for channel in channels:
         btn = InlineKeyboardButton(text=channel[0], url=channel[2])
         inline_keyboard.append([btn])
@@ -172,7 +272,9 @@ def show_channels(db: Database) -> InlineKeyboardMarkup:
     btn_done_sub = InlineKeyboardButton(text="Tekshirish", callback_data="subchanneldone")
     inline_keyboard.append([btn_done_sub])
 
-    return InlineKeyboardMarkup(inline_keyboard)
+    markup = InlineKeyboardMarkup(inline_keyboard)
+    _channels_markup = (version, markup)
+    return markup
 
 
 # MAIN
@@ -182,23 +284,20 @@ async def start(update: Update, context: CallbackContext):
     user = update.message.from_user
 
     # Initialize user session for image collection if not already initialized
-    if user.id not in user_images:
-        user_images[user.id] = []
-    if user.id not in user_documents:
-        user_documents[user.id] = []
+    sessions.session(user.id)
 
     # Send welcome message
     if await check_sub_channels(db, user.id, context, channel_index=0):
-        user_status = db.select_user(user_id=user.id)
+        user_status = await adb.select_user(user_id=user.id)
         if not user_status:
             # Add user to the database if not exists
-            db.add_user(
+            await adb.add_user(
                 user_id=user.id,
                 full_name=user.full_name,
                 username=user.username
             )
             # Get the total count of users
-            count = db.count_users()[0]
+            count = (await adb.count_users())[0]
             await context.bot.send_message(
                 chat_id='-1002028043816',
                 text=f"<b>🆕 Yangi foydalanuvchi!</b>\n"
@@ -209,16 +308,10 @@ async def start(update: Update, context: CallbackContext):
                      f"<b>⚙️ Umumiy:</b> {count} ta",
                 parse_mode='HTML'
             )
-            # Update the count of active users
-            try:
-                active = db.select_active()
-                if active is None or len(active) == 0:
-                    db.add_status(active=1)
-                else:
-                    db.update_active(active=active[0] + 1)
-            except Exception as e:
-                print(f"Error updating active users: {e}")
+            # Active/blocked counts are derived from Users.status, see admin_bot_statics
         else:
+            # A returning user who had blocked the bot is reachable again
+            await adb.update_users_status([user.id], 'active', int(datetime.now().timestamp()))
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text=f"<b>Assalomu alaykum {user.mention_html()}</b>\n"
@@ -238,67 +331,195 @@ async def start(update: Update, context: CallbackContext):
                                        reply_markup=show_channels(db))
 
 
+def build_for(user_id):
+    """
+    The session's incremental build, or None if it has none and can no longer start one: a build
+    must see every file from the first, and at most INCREMENTAL_BUILD_LIMIT builds exist at once.
+    Sessions without a build are converted the batch way.
+    """
+    session = sessions.session(user_id)
+    if session.build is None and len(session.files) == 1 and IncrementalBuild.live < INCREMENTAL_BUILD_LIMIT:
+        session.build = IncrementalBuild(build_executor, quality=PDF_JPEG_QUALITY, level=ZIP_DEFLATE_LEVEL)
+    return session.build
+
+
+def take_build(user_id):
+    session = sessions.get(user_id)
+    if session is None:
+        return None
+    build, session.build = session.build, None
+    return build
+
+
+async def discard_build(build: IncrementalBuild) -> None:
+    # discard() waits for the build thread, so keep it off the event loop
+    await job_pool.run_in_thread(build.discard)
+
+
+async def sweep_sessions() -> None:
+    while True:
+        await asyncio.sleep(60)
+        try:
+            # Sessions nobody converts expire after SESSION_TTL; their files are released
+            sessions.expire()
+            # Partial outputs are dropped sooner, after INCREMENTAL_BUILD_TTL without new files
+            now = time.monotonic()
+            for user_id, session in sessions.items():
+                if session.build is not None and now - session.build.updated > INCREMENTAL_BUILD_TTL:
+                    # The session may have been converted or evicted during an earlier await
+                    build = take_build(user_id)
+                    if build is not None:
+                        await discard_build(build)
+        except Exception as e:
+            logging.error(f"Session sweep failed: {e}")
+
+
+def downloader(context: CallbackContext, file_id: str):
+    # Only called by the blob store on a cache miss, so repeat files cost no API calls
+    async def download(path):
+        file: File = await context.bot.get_file(file_id)
+        await file.download_to_drive(path)
+    return download
+
+
+async def fetch_message_file(context: CallbackContext, message) -> str:
+    if message.photo:
+        photo = message.photo[-1]  # Get the best quality photo
+        return await blob_store.fetch(photo.file_unique_id, f'{photo.file_unique_id}.jpg',
+                                      downloader(context, photo.file_id))
+    dokument = message.document
+    return await blob_store.fetch(dokument.file_unique_id, f'{dokument.file_unique_id}_{dokument.file_name}',
+                                  downloader(context, dokument.file_id))
+
+
+def message_file_size(message) -> int:
+    media = message.photo[-1] if message.photo else message.document
+    return media.file_size or 0
+
+
 async def collect_files(update: Update, context: CallbackContext) -> None:
-    user_id = update.message.from_user.id
-    user = update.message.from_user
-    # Check if the user is subscribed to the required channels
-    if await check_sub_channels(db, user.id, context, channel_index=0):
+    message = update.message
+    if message.media_group_id and (message.photo or message.document):
+        # Album parts arrive as separate updates; gather them and handle the album as one batch
+        key = (message.from_user.id, message.media_group_id)
+        if key not in pending_albums:
+            pending_albums[key] = []
+            context.application.create_task(flush_album(context, key))
+        pending_albums[key].append(message)
+        return
+    await add_files(context, [message])
 
-        if user_id not in user_images:
-            user_images[user_id] = []
-        if user_id not in user_documents:
-            user_documents[user_id] = []
-
-        message_text = ""
-
-        if update.message.photo:
-            photo = update.message.photo[-1]  # Get the best quality photo
-            file: File = await context.bot.get_file(photo.file_id)
-            photo_path = f'documents/{file.file_unique_id}.jpg'
-            await file.download_to_drive(photo_path)
-            user_images[user_id].append(photo_path)
-            message_text = f"Photo saved to {photo_path}"
-        elif update.message.document:
-            dokument = update.message.document
-            file: File = await context.bot.get_file(dokument.file_id)
-            document_path = f'documents/{file.file_unique_id}_{dokument.file_name}'
-            await file.download_to_drive(document_path)
-            user_documents[user_id].append(document_path)
-            message_text = f"Document saved to {document_path}"
-        else:
-            await update.message.reply_text("Please send a photo or document.")
-            return
 
-        keyboard = [
-            [InlineKeyboardButton("PDF yaratish", callback_data='create_pdf')],
-            [InlineKeyboardButton("ZIP yaratish", callback_data='create_zip')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+async def flush_album(context: CallbackContext, key) -> None:
+    # Telegram sends an album's messages back to back; wait until no more arrive
+    count = 0
+    while count != len(pending_albums[key]):
+        count = len(pending_albums[key])
+        await asyncio.sleep(ALBUM_COLLECT_DELAY)
+    messages = sorted(pending_albums.pop(key), key=lambda message: message.message_id)
+    await add_files(context, messages)
 
-        if user_id in last_sent_message_id:
-            try:
-                await context.bot.edit_message_text(
-                    chat_id=update.effective_chat.id,
-                    message_id=last_sent_message_id[user_id],
-                    text="Fayllar qabul qilindi. Barcha fayllarni yuborib bo'lgach, "
-                         f"quyidagi variantlardan birini tanlang.\n Hozircha saqlangan fayllar: "
-                         f"{len(user_images[user_id])} ta foto, {len(user_documents[user_id])} ta hujjat.",
-                    reply_markup=reply_markup
-                )
-            except Exception as e:
-                print(f"Error editing message: {e}")
-        else:
-            sent_message = await context.bot.send_message(
-                chat_id=update.effective_chat.id,
+
+async def show_session_status(context: CallbackContext, chat_id: int, user_id: int) -> None:
+    session = sessions.get(user_id)
+    if session is None or not session.files:
+        # Converted before the update was due
+        return
+
+    keyboard = [
+        [
+            InlineKeyboardButton(preset['label'],
+                                 callback_data='create_pdf' if name == 'original' else f'create_pdf:{name}')
+            for name, preset in PDF_PRESETS.items()
+        ],
+        [InlineKeyboardButton("ZIP yaratish", callback_data='create_zip')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    if session.status_message_id is not None:
+        try:
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=session.status_message_id,
                 text="Fayllar qabul qilindi. Barcha fayllarni yuborib bo'lgach, "
                      f"quyidagi variantlardan birini tanlang.\n Hozircha saqlangan fayllar: "
-                     f"{len(user_images[user_id])} ta foto, {len(user_documents[user_id])} ta hujjat.",
+                     f"{len(session.images)} ta foto, {len(session.documents)} ta hujjat.",
                 reply_markup=reply_markup
             )
-            last_sent_message_id[user_id] = sent_message.message_id
+        except Exception as e:
+            print(f"Error editing message: {e}")
     else:
-        await update.message.reply_text("Siz kanallarga obuna bo'lmaganingiz sababli fayllar qabul qilinmaydi.",
-                                        reply_markup=show_channels(db))
+        sent_message = await context.bot.send_message(
+            chat_id=chat_id,
+            text="Fayllar qabul qilindi. Barcha fayllarni yuborib bo'lgach, "
+                 f"quyidagi variantlardan birini tanlang.\n Hozircha saqlangan fayllar: "
+                 f"{len(session.images)} ta foto, {len(session.documents)} ta hujjat.",
+            reply_markup=reply_markup
+        )
+        sessions.set_status_message(user_id, sent_message.message_id)
+
+
+async def add_files(context: CallbackContext, messages) -> None:
+    """
+    Download the files of one message or one album into the user's session.
+    """
+    first = messages[0]
+    user = first.from_user
+    user_id = user.id
+    chat_id = first.chat_id
+    # Check if the user is subscribed to the required channels
+    if await check_sub_channels(db, user.id, context, channel_index=0):
+
+        messages = [message for message in messages if message.photo or message.document]
+        if not messages:
+            await first.reply_text("Please send a photo or document.")
+            return
+
+        # Saturated: refuse straight away rather than queueing more downloads
+        if blob_store.queued >= DOWNLOAD_QUEUE_SIZE:
+            await first.reply_text(JOB_REJECTED_TEXT['busy'])
+            return
+
+        # Files past the per-session limits are not even downloaded (sizes as reported by Telegram).
+        # Room is reserved until the downloads finish, so batches arriving meanwhile see it as taken
+        sizes = [message_file_size(message) for message in messages]
+        accepted = sessions.reserve(user_id, sizes)
+        sizes = sizes[:accepted]
+        try:
+            if accepted < len(messages):
+                await first.reply_text(f"Bir martada ko'pi bilan {sessions.max_files} ta fayl, jami "
+                                       f"{sessions.max_bytes // 1024 ** 2} MB qabul qilinadi. Avval PDF yoki ZIP yarating.")
+                messages = messages[:accepted]
+                if not messages:
+                    return
+
+            # Downloads run concurrently (bounded by the blob store); pages keep the album's order
+            paths = await asyncio.gather(*(fetch_message_file(context, message) for message in messages),
+                                         return_exceptions=True)
+        finally:
+            # Released right before the files are added, with no await in between
+            sessions.unreserve(user_id, sizes)
+        for message, path in zip(messages, paths):
+            if isinstance(path, BaseException):
+                logging.error(f"Failed to download file from message {message.message_id}: {path}")
+            elif not sessions.add_file(user_id, path, image=bool(message.photo)):
+                # Filled up by another batch during the download, or bigger than Telegram reported
+                blob_store.release([path])
+            else:
+                build = build_for(user_id)
+                if build is not None and message.photo:
+                    build.add_image(path)
+                elif build is not None:
+                    build.add_document(path)
+        if all(isinstance(path, BaseException) for path in paths):
+            await first.reply_text("Faylni yuklab olishda xatolik yuz berdi, qaytadan yuboring.")
+            return
+
+        # A burst of files becomes one status edit showing the latest counts
+        status_updates.schedule(user_id, lambda: show_session_status(context, chat_id, user_id))
+    else:
+        await first.reply_text("Siz kanallarga obuna bo'lmaganingiz sababli fayllar qabul qilinmaydi.",
+                               reply_markup=show_channels(db))
 
 
 async def button(update: Update, context: CallbackContext) -> None:
@@ -308,6 +529,8 @@ async def button(update: Update, context: CallbackContext) -> None:
 
     if query.data == 'create_pdf':
         await create_pdf_command(update, context, user_id)
+    elif query.data.startswith('create_pdf:'):
+        await create_pdf_command(update, context, user_id, preset=query.data.split(':', 1)[1])
     elif query.data == 'create_zip':
         await create_zip_command(update, context, user_id)
     elif query.data == 'subchanneldone':
@@ -315,69 +538,165 @@ async def button(update: Update, context: CallbackContext) -> None:
     # Edit the message to indicate the file is being processed
 
 
-async def create_pdf_command(update: Update, context: CallbackContext, user_id: int) -> None:
-    if user_id in user_images and user_images[user_id]:
-        pdf_path = 'documents/images.pdf'
-        images_to_convert = user_images[user_id]
-
-        convert_to_pdf(images_to_convert, pdf_path)
-
-        await context.bot.send_document(chat_id=update.effective_chat.id, document=open(pdf_path, 'rb'))
-
-        user_images[user_id] = []
-        for image_path in images_to_convert:
-            os.remove(image_path)
-
-        os.remove(pdf_path)
-    else:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="Iltimos, avval rasmlarni yuboring.")
-
-    if user_id in last_sent_message_id:
-        try:
-            del last_sent_message_id[user_id]
-        except Exception as e:
-            print(f"Error clearing last sent message: {e}")
+async def send_cached_output(context: CallbackContext, chat_id: int, digest: str) -> bool:
+    """
+    Re-send an output uploaded earlier for the same inputs and options by its file_id.
+    Returns False when there is none (or Telegram no longer accepts it), so the caller builds it.
+    """
+    file_id = await adb.select_output_file_id(digest)
+    if file_id is None:
+        return False
+    try:
+        await context.bot.send_document(chat_id=chat_id, document=file_id, rate_limit_args='conversion')
+        return True
+    except BadRequest as e:
+        logging.error(f"Cached output {digest} could not be sent: {e}")
+        await adb.delete_output(digest)
+        return False
 
 
-async def create_zip_command(update: Update, context: CallbackContext, user_id: int) -> None:
-    user_files = user_images.get(user_id, []) + user_documents.get(user_id, [])
-    if not user_files:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="Siz hech qanday fayl yubormadingiz.")
-        return
+async def remember_output(digest: str, kind: str, message) -> None:
+    try:
+        await adb.add_output(digest, kind, message.document.file_id, int(time.time()))
+    except Exception as e:
+        logging.error(f"Failed to cache output {digest}: {e}")
 
-    zip_filename = create_zip(user_id, user_files)
 
-    user_images[user_id] = []
-    user_documents[user_id] = []
+JOB_REJECTED_TEXT = {
+    'user': "⏳ Oldingi faylingiz hali tayyorlanmoqda, biroz kuting.",
+    'busy': "⚠️ Bot hozir band, birozdan so'ng qayta urinib ko'ring."
+}
 
-    await context.bot.send_document(chat_id=update.effective_chat.id, document=open(zip_filename, 'rb'))
-    os.remove(zip_filename)
 
-    if user_id in last_sent_message_id:
+async def conversion_failed(context: CallbackContext, chat_id: int, status) -> None:
+    # The files are back in the session, so the user can simply press the button again
+    try:
+        if status is not None:
+            await status.delete()
+        await context.bot.send_message(chat_id=chat_id,
+                                       text="❌ Faylni tayyorlashda xatolik yuz berdi. Qaytadan urinib ko'ring.")
+    except Exception as e:
+        logging.error(f"Failed to report conversion error to {chat_id}: {e}")
+
+
+async def create_pdf_command(update: Update, context: CallbackContext, user_id: int, preset: str = 'original') -> None:
+    chat_id = update.effective_chat.id
+    options = PDF_PRESETS.get(preset, PDF_PRESETS['original'])
+    session = sessions.get(user_id)
+    if session is not None and session.images:
         try:
-            del last_sent_message_id[user_id]
-        except Exception as e:
-            print(f"Error clearing last sent message: {e}")
-
-
-def convert_to_pdf(image_paths, output_file):
-    images = [Image.open(image_path) for image_path in image_paths]
-    images[0].save(output_file, save_all=True, append_images=images[1:])
-    for image in images:
-        image.close()
+            async with job_pool.job(user_id):
+                # Take the files out of the session so new uploads start a fresh batch
+                images_to_convert = sessions.take_images(user_id)
+                status_updates.cancel(user_id)
+
+                build = take_build(user_id)
+                status = sent = None
+
+                # The button label does not affect the output
+                digest = output_digest('pdf', blob_store.unique_ids(images_to_convert),
+                                       {name: value for name, value in options.items() if name != 'label'})
+
+                # Every job gets its own directory, so parallel conversions never share an output path
+                try:
+                    if not await send_cached_output(context, chat_id, digest):
+                        status = await context.bot.send_message(chat_id=chat_id, text="⏳ PDF tayyorlanmoqda...")
+                        if build is not None and preset == 'original' and build.covers_pdf(images_to_convert):
+                            # Pages were already written while the photos arrived; just close the file
+                            pdf_path = await job_pool.run_in_thread(build.finish_pdf)
+                            with open(pdf_path, 'rb') as pdf:
+                                sent = await context.bot.send_document(chat_id=chat_id, document=pdf,
+                                                                       rate_limit_args='conversion')
+                        else:
+                            with workspace() as job_dir:
+                                pdf_path = await job_pool.run(
+                                    convert_to_pdf, images_to_convert, os.path.join(job_dir, 'images.pdf'),
+                                    quality=options['quality'], passthrough=options['passthrough'],
+                                    max_edge=options['max_edge'], dpi=options['dpi'], workers=PDF_PAGE_WORKERS
+                                )
+                                with open(pdf_path, 'rb') as pdf:
+                                    sent = await context.bot.send_document(chat_id=chat_id, document=pdf,
+                                                                           rate_limit_args='conversion')
+                        await remember_output(digest, 'pdf', sent)
+                        await status.delete()
+                except Exception as e:
+                    logging.error(f"Failed to create PDF for {user_id}: {e!r}")
+                    if sent is None:
+                        # Not delivered: the files (and their blob references) go back to the session
+                        sessions.restore_files(user_id, images=images_to_convert)
+                        images_to_convert = []
+                        await conversion_failed(context, chat_id, status)
+                        return
+                finally:
+                    if build is not None:
+                        await discard_build(build)
+                    blob_store.release(images_to_convert)
+        except JobRejected as e:
+            await context.bot.send_message(chat_id=chat_id, text=JOB_REJECTED_TEXT[e.reason])
+            return
+    else:
+        await context.bot.send_message(chat_id=chat_id, text="Iltimos, avval rasmlarni yuboring.")
 
+    sessions.clear_status_message(user_id)
 
-def create_zip(user_id, user_files):
-    zip_filename = f"documents/ZipFile.zip"
 
-    with zipfile.ZipFile(zip_filename, 'w') as zipf:
-        for file_path in user_files:
-            zipf.write(file_path, os.path.basename(file_path))
+async def create_zip_command(update: Update, context: CallbackContext, user_id: int) -> None:
+    chat_id = update.effective_chat.id
+    session = sessions.get(user_id)
+    if session is None or not session.files:
+        await context.bot.send_message(chat_id=chat_id, text="Siz hech qanday fayl yubormadingiz.")
+        return
 
-    for file_path in user_files:
-        os.remove(file_path)
+    try:
+        async with job_pool.job(user_id):
+            images, documents = sessions.take_files(user_id)
+            user_files = images + documents
+            status_updates.cancel(user_id)
+
+            build = take_build(user_id)
+            status = sent = None
+            digest = output_digest('zip', blob_store.unique_ids(user_files))
+            try:
+                if not await send_cached_output(context, chat_id, digest):
+                    status = await context.bot.send_message(chat_id=chat_id, text="⏳ ZIP tayyorlanmoqda...")
+                    if build is not None and build.covers_zip(user_files):
+                        # Members were already archived while the files arrived; just write the directory
+                        zip_filename = await job_pool.run_in_thread(build.finish_zip)
+                        with open(zip_filename, 'rb') as archive:
+                            sent = await context.bot.send_document(chat_id=chat_id, document=archive,
+                                                                   rate_limit_args='conversion')
+                    else:
+                        with workspace() as job_dir:
+                            # The archive is built straight into the upload buffer; it only touches the disk
+                            # when it grows past ZIP_SPOOL_MAX_SIZE. Inputs are shared blobs, so they are
+                            # released afterwards rather than deleted. python-telegram-bot loads the upload
+                            # body into memory anyway, so it gets bytes.
+                            with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE, dir=job_dir) as archive:
+                                await job_pool.run_in_thread(write_zip, user_files, archive, workers=ZIP_WORKERS,
+                                                             level=ZIP_DEFLATE_LEVEL)
+                                archive.seek(0)
+                                sent = await context.bot.send_document(chat_id=chat_id, document=archive.read(),
+                                                                       filename='ZipFile.zip',
+                                                                       rate_limit_args='conversion')
+                    await remember_output(digest, 'zip', sent)
+                    await status.delete()
+            except Exception as e:
+                logging.error(f"Failed to create ZIP for {user_id}: {e!r}")
+                if sent is None:
+                    # Not delivered: the files (and their blob references) go back to the session
+                    sessions.restore_files(user_id, images=images, documents=documents)
+                    user_files = []
+                    await conversion_failed(context, chat_id, status)
+                    return
+            finally:
+                if build is not None:
+                    await discard_build(build)
+                blob_store.release(user_files)
+    except JobRejected as e:
+        await context.bot.send_message(chat_id=chat_id, text=JOB_REJECTED_TEXT[e.reason])
+        return
 
-    return zip_filename
+    sessions.clear_status_message(user_id)
 
 
 """ADMIN"""
@@ -392,7 +711,8 @@ AdminPanel = InlineKeyboardMarkup([
         InlineKeyboardButton("➕ Kanal qo'shish", callback_data='admin:add_channel')  # Yangi tugma
     ],
     [
-        InlineKeyboardButton("📋 Kanallar", callback_data='admin:channels')  # Yangi tugma qo'shildi
+        InlineKeyboardButton("📋 Kanallar", callback_data='admin:channels'),  # Yangi tugma qo'shildi
+        InlineKeyboardButton("📨 Xabarlar", callback_data='admin:broadcasts')
     ]
 ])
 
@@ -451,7 +771,7 @@ async def handle_channels(update, context):
     admin_id = query.from_user.id
 
     # Retrieve the list of channels from the database
-    channels = db.select_all_channel()
+    channels = await adb.select_all_channel()
     print(f"Retrieved channels in handle_channels: {channels}")  # Debug statement
 
     # Check if there are channels in the database
@@ -488,7 +808,7 @@ async def handle_channel_deletion(update: Update, context: CallbackContext):
             return
 
         # Delete the channel from the database if it exists
-        if db.delete_channel_by_name(message_text.text):
+        if await adb.delete_channel_by_name(message_text.text):
             await update.message.reply_text(f"{message_text} nomli kanal muvaffaqiyatli o'chirildi.")
         else:
             await update.message.reply_text(f"{message_text} nomli kanal topilmadi.")
@@ -503,14 +823,22 @@ async def handle_admin_buttons(update, context):
         await handle_channels(update, context)
 
 
+def broadcast_keyboard(broadcast_id: int, status: str) -> InlineKeyboardMarkup:
+    if status == 'paused':
+        toggle = InlineKeyboardButton("▶️ Davom ettirish", callback_data=f'broadcast:resume:{broadcast_id}')
+    else:
+        toggle = InlineKeyboardButton("⏸ To'xtatish", callback_data=f'broadcast:pause:{broadcast_id}')
+    return InlineKeyboardMarkup([
+        [toggle, InlineKeyboardButton("❌ Bekor qilish", callback_data=f'broadcast:cancel:{broadcast_id}')]
+    ])
+
+
 # Message Handler
 async def receive_message(update: Update, context: CallbackContext) -> None:
     if context.user_data.get('awaiting_message'):
+        context.user_data['awaiting_message'] = False
         message = update.message
-        users = db.select_all_users()
-        count = db.count_users()[0]
-        x = 0
-        y = 0
+        count = (await adb.count_users_to_broadcast(reprobe_before(datetime.now())))[0]
 
         start_ads = datetime.now(pytz.timezone('Asia/Tashkent'))
         text = await message.reply_text(
@@ -520,48 +848,216 @@ async def receive_message(update: Update, context: CallbackContext) -> None:
             parse_mode='HTML'
         )
 
-        for user in users:
-            try:
-                if message.text:
-                    await context.bot.send_message(chat_id=user[0], text=message.text)
-                elif message.photo:
-                    await context.bot.send_photo(chat_id=user[0], photo=message.photo[-1].file_id,
-                                                 caption=message.caption)
-                elif message.video:
-                    await context.bot.send_video(chat_id=user[0], video=message.video.file_id, caption=message.caption)
-                elif message.document:
-                    await context.bot.send_document(chat_id=user[0], document=message.document.file_id,
-                                                    caption=message.caption)
-                elif message.audio:
-                    await context.bot.send_audio(chat_id=user[0], audio=message.audio.file_id, caption=message.caption)
-                elif message.voice:
-                    await context.bot.send_voice(chat_id=user[0], voice=message.voice.file_id, caption=message.caption)
-                elif message.sticker:
-                    await context.bot.send_sticker(chat_id=user[0], sticker=message.sticker.file_id)
-                else:
-                    await context.bot.copy_message(chat_id=user[0], from_chat_id=message.chat_id,
-                                                   message_id=message.message_id)
-
-                x += 1
-            except Exception as e:
-                y += 1
-                print(f"Failed to send message to {user[0]}: {e}")
-
-            await asyncio.sleep(0.05)
-
-        finish_ads = datetime.now(pytz.timezone('Asia/Tashkent'))
-        db.update_active(active=x)
-        db.update_block(block=y)
-        await text.edit_text(
-            text=f"<b>📨 Xabar yuborilishi yakunlandi</b>\n\n"
-                 f"<b>📤 Yuborildi:</b> {x}/{x + y} ta\n"
-                 f"<b>⏰ Boshlandi:</b> {start_ads.strftime('%d/%m/%Y  %H:%M:%S')}\n"
-                 f"<b>⏰ Yakunlandi:</b> {finish_ads.strftime('%d/%m/%Y  %H:%M:%S')}\n"
-                 f"<b>🕓 Umumiy ketgan vaqt:</b> {(finish_ads - start_ads).seconds} soniya",
+        # Persist the job first so it survives a restart, then run it in the background
+        kind, file_id, caption = message_content(message)
+        broadcast_id = await adb.add_broadcast(
+            from_chat_id=message.chat_id,
+            message_id=message.message_id,
+            kind=kind,
+            file_id=file_id,
+            text=caption,
+            total=count,
+            progress_chat_id=text.chat_id,
+            progress_message_id=text.message_id,
+            started_at=start_ads.isoformat()
+        )
+        await text.edit_reply_markup(reply_markup=broadcast_keyboard(broadcast_id, 'running'))
+        start_broadcast(context.application, broadcast_id)
+
+
+def reprobe_before(started: datetime) -> int:
+    # Blocked users last checked before this timestamp are tried again by a broadcast
+    return int(started.timestamp()) - BROADCAST_REPROBE_DAYS * 24 * 60 * 60
+
+
+def start_background(coroutine) -> asyncio.Task:
+    # Not application.create_task: Application.stop() waits for those, and a broadcast can run
+    # for hours (or forever while paused). These are cancelled in post_stop instead.
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def start_broadcast(application, broadcast_id: int, status: str = 'running') -> None:
+    broadcast_controls[broadcast_id] = BroadcastControl(status)
+    start_background(run_broadcast(application.bot, broadcast_id))
+
+
+async def resume_broadcasts(application) -> None:
+    # Pick up jobs interrupted by a restart from their last checkpoint
+    for job in await adb.select_unfinished_broadcasts():
+        start_broadcast(application, job['id'], job['status'])
+
+
+async def sweep_spool() -> None:
+    while True:
+        try:
+            await job_pool.run_in_thread(spool.sweep)
+        except Exception as e:
+            logging.error(f"Spool sweep failed: {e}")
+        await asyncio.sleep(SPOOL_SWEEP_INTERVAL)
+
+
+async def flush_sessions() -> None:
+    # Session changes are batched here so handlers never wait on an SQLite commit
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+        await job_pool.run_in_thread(sessions.flush)
+
+
+async def post_init(application) -> None:
+    await resume_broadcasts(application)
+    start_background(sweep_sessions())
+    start_background(sweep_spool())
+    start_background(flush_sessions())
+
+
+async def post_stop(application) -> None:
+    # Broadcasts resume from their last checkpoint on the next start
+    tasks = list(background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def post_shutdown(application) -> None:
+    # Whatever changed since the last tick
+    sessions.flush()
+    # Explicitly, rather than at interpreter teardown where spawned workers can hang the exit
+    build_executor.shutdown()
+    job_pool.shutdown()
+    # Last: closes the executor threads and every per-thread connection, including the one above
+    await adb.close()
+
+
+async def run_broadcast(bot, broadcast_id: int) -> None:
+    job = await adb.select_broadcast(broadcast_id)
+    control = broadcast_controls[broadcast_id]
+    start_ads = datetime.fromisoformat(job['started_at'])
+    cursor = job['cursor']
+    reprobe = reprobe_before(start_ads)
+    broadcaster = Broadcaster(broadcast_limiter, concurrency=BROADCAST_CONCURRENCY, sent=job['sent'],
+                              failed=job['failed'])
+
+    async def edit_progress(text, reply_markup):
+        try:
+            await bot.edit_message_text(
+                chat_id=job['progress_chat_id'],
+                message_id=job['progress_message_id'],
+                text=text,
+                parse_mode='HTML',
+                reply_markup=reply_markup,
+                rate_limit_args='broadcast'
+            )
+        except Exception as e:
+            logging.error(f"Failed to update broadcast progress: {e}")
+
+    async def report_progress():
+        shown = None
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            status = control.status
+            title = "⏸ Xabar yuborish to'xtatildi" if status == 'paused' else "📨 Xabar yuborilmoqda..."
+            text = (f"<b>{title}</b>\n\n"
+                    f"<b>📤 Yuborildi:</b> {broadcaster.sent}/{job['total']} ta\n"
+                    f"<b>❌ Yuborilmadi:</b> {broadcaster.failed} ta\n"
+                    f"<b>⏰ Boshlandi:</b> {start_ads.strftime('%d/%m/%Y  %H:%M:%S')}")
+            # Telegram rejects an edit that changes nothing, so don't spend a request on it
+            if (text, status) != shown:
+                shown = (text, status)
+                await edit_progress(text, broadcast_keyboard(broadcast_id, status))
+            if status == 'paused':
+                # Nothing moves while paused; wake up again on resume or cancel
+                await control.wait_if_paused()
+
+    progress_task = asyncio.create_task(report_progress())
+    try:
+        while True:
+            await control.wait_if_paused()
+            if control.status == 'cancelled':
+                break
+            chat_ids = await adb.select_user_ids_after(cursor, BROADCAST_BATCH_SIZE, reprobe_before=reprobe)
+            if not chat_ids:
+                break
+            await broadcaster.run(chat_ids, lambda chat_id: send_content(bot, chat_id, job), control=control)
+            cursor = chat_ids[-1]
+            now = int(datetime.now().timestamp())
+            delivered, blocked = broadcaster.take_outcomes()
+            await adb.update_users_status(delivered, 'active', now)
+            await adb.update_users_status(blocked, 'blocked', now)
+            await adb.update_broadcast_checkpoint(broadcast_id, cursor, broadcaster.sent, broadcaster.failed)
+    finally:
+        progress_task.cancel()
+        broadcast_controls.pop(broadcast_id, None)
+
+    finish_ads = datetime.now(pytz.timezone('Asia/Tashkent'))
+    status = 'cancelled' if control.status == 'cancelled' else 'done'
+    await adb.update_broadcast_status(broadcast_id, status, finished_at=finish_ads.isoformat())
+
+    # Counters come from the persisted checkpoint, so they cover every run of a resumed job
+    job = await adb.select_broadcast(broadcast_id)
+    x, y = job['sent'], job['failed']
+    title = "❌ Xabar yuborish bekor qilindi" if status == 'cancelled' else "📨 Xabar yuborilishi yakunlandi"
+    await edit_progress(
+        f"<b>{title}</b>\n\n"
+        f"<b>📤 Yuborildi:</b> {x}/{x + y} ta\n"
+        f"<b>⏰ Boshlandi:</b> {start_ads.strftime('%d/%m/%Y  %H:%M:%S')}\n"
+        f"<b>⏰ Yakunlandi:</b> {finish_ads.strftime('%d/%m/%Y  %H:%M:%S')}\n"
+        f"<b>🕓 Umumiy ketgan vaqt:</b> {(finish_ads - start_ads).seconds} soniya",
+        GoBack
+    )
+
+
+async def broadcast_control(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    if query.from_user.id not in ADMINS:
+        await query.answer("Sizda bu amalni bajarish huquqi yo'q.")
+        return
+
+    _, action, broadcast_id = query.data.split(':')
+    broadcast_id = int(broadcast_id)
+    control = broadcast_controls.get(broadcast_id)
+    if control is None:
+        await query.answer("Bu xabar yuborish allaqachon yakunlangan.")
+        return
+
+    if action == 'pause':
+        control.pause()
+        await adb.update_broadcast_status(broadcast_id, 'paused')
+        await query.answer("To'xtatildi.")
+    elif action == 'resume':
+        control.resume()
+        await adb.update_broadcast_status(broadcast_id, 'running')
+        await query.answer("Davom ettirilmoqda.")
+    elif action == 'cancel':
+        control.cancel()
+        await query.answer("Bekor qilindi.")
+        return
+
+    try:
+        await query.edit_message_reply_markup(reply_markup=broadcast_keyboard(broadcast_id, control.status))
+    except Exception as e:
+        logging.error(f"Failed to update broadcast keyboard: {e}")
+
+
+async def admin_broadcasts(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    await query.answer()
+    if not broadcast_controls:
+        await query.message.reply_text("Hozirda yuborilayotgan xabarlar yo'q.")
+        return
+
+    # A copy: broadcasts may start or finish while the replies are being sent
+    for broadcast_id, control in list(broadcast_controls.items()):
+        job = await adb.select_broadcast(broadcast_id)
+        await query.message.reply_text(
+            f"<b>📨 Xabar #{broadcast_id}</b>\n\n"
+            f"<b>📤 Yuborildi:</b> {job['sent']}/{job['total']} ta\n"
+            f"<b>❌ Yuborilmadi:</b> {job['failed']} ta",
             parse_mode='HTML',
-            reply_markup=GoBack
+            reply_markup=broadcast_keyboard(broadcast_id, control.status)
         )
-        context.user_data['awaiting_message'] = False
 
 
 async def handle_admin_message(update: Update, context: CallbackContext) -> None:
@@ -600,7 +1096,7 @@ async def handle_channel_info(update: Update, context: CallbackContext) -> None:
             # Print the data to debug
             print(f"Adding channel: {channel_name}, {channel_id}, {channel_link}")
 
-            success = db.add_channel(channel_name, channel_id, channel_link)
+            success = await adb.add_channel(channel_name, channel_id, channel_link)
 
             # Print success status
             print(f"Channel added successfully: {success}")
@@ -621,14 +1117,16 @@ async def handle_channel_info(update: Update, context: CallbackContext) -> None:
 
 async def admin_bot_statics(update: Update, context: CallbackContext) -> None:
     text = await update.callback_query.message.edit_text("<b>📊 Bot statistikasi yuklanmoqda...</b>")
-    try:
-        active = db.select_active()[0]
-    except:
-        active = 0
-    try:
-        block = db.select_block()[0]
-    except:
-        block = 0
+    # Per-user delivery status, counted through the (status, user_id) index
+    counts = await adb.count_users_by_status()
+    active = counts.get('active', 0)
+    block = counts.get('blocked', 0)
+    blobs = blob_store.stats()
+    queues = "".join(
+        f"<b>⏱ {name}:</b> {stats['requests']} ta, o'rtacha {stats['avg_wait_ms']:.0f} ms, "
+        f"eng ko'p {stats['max_wait_ms']:.0f} ms, navbatda {stats['waiting']}\n"
+        for name, stats in api_limiter.queue_stats().items()
+    )
 
     start_bot = datetime(year=2024, month=8, day=12)
     today_bot = datetime.now().date()
@@ -639,6 +1137,14 @@ async def admin_bot_statics(update: Update, context: CallbackContext) -> None:
              f"<b>❌ Blok:</b> {block} ta\n"
              f"<b>🔰 Umumiy:</b> {active + block} ta\n"
              f"➖➖➖➖➖➖➖➖\n"
+             f"<b>🗄 Fayl keshi:</b> {blobs['blobs']} ta, {blobs['bytes'] / 1024 ** 2:.1f} MB\n"
+             f"<b>🎯 Kesh:</b> {blobs['hits']} topildi, {blobs['misses']} yuklandi, "
+             f"{blobs['evictions']} o'chirildi\n"
+             f"<b>💾 documents/:</b> {spool.usage / 1024 ** 2:.1f} MB band, "
+             f"{spool.reclaimed / 1024 ** 2:.1f} MB tozalandi\n"
+             f"➖➖➖➖➖➖➖➖\n"
+             f"{queues}"
+             f"➖➖➖➖➖➖➖➖\n"
              f"<b>⏸ Bot ishga tushgan:</b> {start_bot.strftime('%d/%m/%Y')}\n"
              f"<b>📆 Bugun:</b> {today_bot.strftime('%d/%m/%Y')}\n"
              f"<b>📆 Bot ishga tushganiga:</b> {(today_bot_datetime - start_bot).days} kun bo'ldi",
@@ -656,6 +1162,8 @@ async def save_base(update: Update, context: CallbackContext) -> None:
 
 async def dot_db(update: Update, context: CallbackContext) -> None:
     await update.callback_query.message.delete()
+    # Make sure recent writes sitting in the WAL are part of the file we send
+    await adb.checkpoint()
     input_file = 'database.db'
     with open(input_file, 'rb') as file:
         await context.bot.send_document(
@@ -668,7 +1176,7 @@ async def dot_db(update: Update, context: CallbackContext) -> None:
 
 async def dot_xlsx(update: Update, context: CallbackContext) -> None:
     await update.callback_query.message.delete()
-    users = db.select_all_users()
+    users = await adb.select_all_users()
 
     workbook = xl.Workbook("users.xlsx")
     bold_format = workbook.add_format({'bold': True})
@@ -711,8 +1219,10 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
 
 
 def main():
+    init()
     # Replace 'YOUR_ACTUAL_BOT_TOKEN' with your actual bot token
-    application = ApplicationBuilder().token(API_TOKEN).build()
+    application = (ApplicationBuilder().token(API_TOKEN).rate_limiter(api_limiter).post_init(post_init)
+                   .post_stop(post_stop).post_shutdown(post_shutdown).build())
 
     # Add handlers
     application.add_handler(CommandHandler('start', start))
@@ -732,7 +1242,10 @@ def main():
     application.add_handler(CallbackQueryHandler(dot_db, pattern='base:db'))
     application.add_handler(CallbackQueryHandler(dot_xlsx, pattern='base:xlsx'))
     application.add_handler(CallbackQueryHandler(handle_admin_message, pattern='admin:add_channel'))
-    application.add_handler(CallbackQueryHandler(button))
+    application.add_handler(CallbackQueryHandler(admin_broadcasts, pattern='admin:broadcasts'))
+    application.add_handler(CallbackQueryHandler(broadcast_control, pattern='^broadcast:'))
+    # block=False: a long conversion must not hold up updates from other users
+    application.add_handler(CallbackQueryHandler(button, block=False))
     application.add_handler(CallbackQueryHandler(handle_callback_query))
 
     # Start the bot
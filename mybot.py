@@ -1,21 +1,51 @@
 import telebot
+from concurrent.futures import ThreadPoolExecutor, wait
 from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
 from data import Database
+from cache import MembershipCache
+from sessions import SessionStore
 import logging
-from config import API_TOKEN, ADMINS, NOT_SUB_MESSAGE
+import threading
+import time
+from config import API_TOKEN, ADMINS, NOT_SUB_MESSAGE, SUB_CACHE_TTL, SUB_CACHE_SIZE, SUB_CHECK_CONCURRENCY, \
+    SUB_CHECK_TIMEOUT, SESSION_TTL, SESSION_MAX_COUNT, SESSION_MAX_FILES, SESSION_MAX_BYTES
 # Initialize the bot with your API token
 
 bot = telebot.TeleBot(API_TOKEN)
 
 # Create a Database instance
 db = Database(path_to_db="database.db")
+membership_cache = MembershipCache(ttl=SUB_CACHE_TTL, maxsize=SUB_CACHE_SIZE)
+sub_check_executor = ThreadPoolExecutor(max_workers=SUB_CHECK_CONCURRENCY)
+
+sessions = SessionStore(ttl=SESSION_TTL, max_sessions=SESSION_MAX_COUNT, max_files=SESSION_MAX_FILES,
+                        max_bytes=SESSION_MAX_BYTES)
+
+
+def is_channel_member(chat_id, user_id) -> bool:
+    cached = membership_cache.get(user_id, chat_id)
+    if cached is not None:
+        return cached
+    member = bot.get_chat_member(chat_id, user_id)
+    subscribed = member.status in ['member', 'administrator', 'creator']
+    membership_cache.set(user_id, chat_id, subscribed)
+    return subscribed
+
+
+# (channels_version, markup) of the last keyboard built by show_channels
+_channels_markup = (None, None)
 
-user_images = {}
-user_documents = {}
 
 def show_channels():
-    inline_keyboard = []
+    global _channels_markup
+    # Also picks up channels changed by the other process, bumping channels_version
     channels = db.get_channels_from_db()
+    version = db.channels_version
+    cached_version, markup = _channels_markup
+    if cached_version == version:
+        return markup
+
+    inline_keyboard = []
     print(f"Channels fetched: {channels}")
     for index, channel in enumerate(channels):
         btn = InlineKeyboardButton(text=channel[0], url=channel[2])
@@ -24,7 +54,9 @@ def show_channels():
     btn_done_sub = InlineKeyboardButton(text="Tekshirish", callback_data="subchanneldone")
     inline_keyboard.append([btn_done_sub])
 
-    return InlineKeyboardMarkup(inline_keyboard)
+    markup = InlineKeyboardMarkup(inline_keyboard)
+    _channels_markup = (version, markup)
+    return markup
 
 
 # Handle callback queries
@@ -34,6 +66,7 @@ def handle_callback_query(call):
     chat_id = call.from_user.id
 
     if query_data == "subchanneldone":
+        membership_cache.invalidate(chat_id)
         subscribed = check_sub_channels(chat_id)
         bot.answer_callback_query(call.id, "Tekshirish amalga oshirildi.")
         if subscribed:
@@ -46,8 +79,7 @@ def handle_callback_query(call):
             channel = channels[channel_index]
             chat_id = channel[1]
             try:
-                member = bot.get_chat_member(chat_id, call.from_user.id)
-                if member.status in ['member', 'administrator', 'creator']:
+                if is_channel_member(chat_id, call.from_user.id):
                     button_text = f"{channel[0]} ✅"
                 else:
                     button_text = f"{channel[0]} ❌"
@@ -79,11 +111,7 @@ def check_sub_channels(user_id, channel_index=None):
             channel = channels[channel_index]
             chat_id = channel[1]
             try:
-                member = bot.get_chat_member(chat_id, user_id)
-                if member.status in ['member', 'administrator', 'creator']:
-                    return True
-                else:
-                    return False
+                return is_channel_member(chat_id, user_id)
             except Exception as e:
                 print(f"Failed to check subscription for channel {chat_id}: {e}")
                 return False
@@ -91,17 +119,23 @@ def check_sub_channels(user_id, channel_index=None):
             print("Invalid channel index provided.")
             return False
 
-    # Check all channels if no specific index is provided
-    for index, channel in enumerate(channels):
+    # Check all channels concurrently if no specific index is provided
+    # One deadline for all of them; checks still running by then count as not subscribed
+    futures = [sub_check_executor.submit(is_channel_member, channel[1], user_id) for channel in channels]
+    wait(futures, timeout=SUB_CHECK_TIMEOUT)
+    for index, (channel, future) in enumerate(zip(channels, futures)):
         chat_id = channel[1]
         try:
-            member = bot.get_chat_member(chat_id, user_id)
-            if member.status in ['member', 'administrator', 'creator']:
+            if not future.done():
+                future.cancel()
+                print(f"Subscription check for channel {chat_id} timed out")
+                not_subscribed_channels.append((index, channel))
+            elif future.result():
                 subscribed_channels.append((index, channel))
             else:
                 not_subscribed_channels.append((index, channel))
         except Exception as e:
-            print(f"Failed to check subscription for channel {chat_id}: {e}")
+            print(f"Failed to check subscription for channel {chat_id}: {e!r}")
             not_subscribed_channels.append((index, channel))
 
     # If subscribed to all channels
@@ -152,10 +186,7 @@ def start(message):
     user = message.from_user
 
     # Initialize user session for image collection if not already initialized
-    if user.id not in user_images:
-        user_images[user.id] = []
-    if user.id not in user_documents:
-        user_documents[user.id] = []
+    sessions.session(user.id)
 
     # Send welcome message
     if check_sub_channels(user.id, channel_index=1):
@@ -181,15 +212,6 @@ def start(message):
                 ),
                 parse_mode='HTML'
             )
-            # Update the count of active users
-            try:
-                active = db.select_active()
-                if active is None or len(active) == 0:
-                    db.add_status(active=1)
-                else:
-                    db.update_active(active=active[0] + 1)
-            except Exception as e:
-                print(f"Error updating active users: {e}")
         else:
             bot.send_message(
                 chat_id=message.chat.id,
@@ -216,5 +238,16 @@ def handle_start(message):
 
 # Function to create channel buttons
 
+def sweep_sessions():
+    # Sessions nobody converts expire after SESSION_TTL
+    while True:
+        time.sleep(60)
+        try:
+            sessions.expire()
+        except Exception as e:
+            logging.error(f"Session sweep failed: {e}")
+
+
 if __name__ == '__main__':
+    threading.Thread(target=sweep_sessions, name="session-sweeper", daemon=True).start()
     bot.polling(none_stop=True)
@@ -0,0 +1,107 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from broadcast import TokenBucket, retry_after_seconds
+
+
+class ClassStats:
+    def __init__(self):
+        self.requests = 0
+        self.waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "waiting": self.waiting,
+            "avg_wait_ms": self.total_wait / self.requests * 1000 if self.requests else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    Outbound rate limiter with priority classes, plugged into python-telegram-bot.
+    Requests pick their class with `rate_limit_args` ("interactive", "conversion", "broadcast");
+    untagged requests are interactive. `shares` is ordered by priority and maps each class to the
+    fraction of `rate` it may use at most. When classes compete for the shared budget, a waiting
+    request of a higher class always gets the next token first.
+    """
+
+    # Not messages: never held back (getUpdates is already exempt in python-telegram-bot)
+    UNLIMITED_ENDPOINTS = {"getMe", "getFile", "getChat", "getChatMember", "answerCallbackQuery"}
+
+    def __init__(self, rate: float = 30, shares: dict = None):
+        shares = shares or {"interactive": 1.0, "conversion": 0.5, "broadcast": 0.8}
+        self.default = next(iter(shares))
+        self.priorities = {name: priority for priority, name in enumerate(shares)}
+        self.buckets = {name: TokenBucket(rate * share) for name, share in shares.items()}
+        self.stats = {name: ClassStats() for name in shares}
+        self._total = TokenBucket(rate)
+        self._waiters = []
+        self._order = itertools.count()
+        self._dispatcher = None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+
+    async def _dispatch(self):
+        # Hands out tokens of the shared budget to the highest-priority waiter, oldest first
+        while self._waiters:
+            await self._total.acquire()
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+
+    async def _acquire(self, name: str):
+        await self.buckets[name].acquire()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (self.priorities[name], next(self._order), waiter))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await waiter
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in self.UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        name = rate_limit_args if rate_limit_args in self.buckets else self.default
+        stats = self.stats[name]
+        started = time.monotonic()
+        stats.waiting += 1
+        try:
+            await self._acquire(name)
+        finally:
+            stats.waiting -= 1
+        waited = time.monotonic() - started
+        stats.requests += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+
+        try:
+            return await callback(*args, **kwargs)
+        except RetryAfter as e:
+            # Flood control applies to the whole bot, so every class waits
+            delay = retry_after_seconds(e)
+            logging.warning(f"Flood limit on {endpoint}, pausing all requests for {delay} s")
+            self._total.pause(delay)
+            raise
+
+    def queue_stats(self) -> dict:
+        """
+        Per class: requests sent, requests waiting now, average and maximum queue wait in ms.
+        """
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
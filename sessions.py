@@ -0,0 +1,270 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class Session:
+    """
+    Files a user has sent since their last conversion, plus the "files received" status message.
+    """
+
+    def __init__(self, images=None, documents=None, status_message_id=None, updated=None):
+        self.images = images or []
+        self.documents = documents or []
+        self.status_message_id = status_message_id
+        self.updated = updated if updated is not None else time.time()
+        # Partial outputs being built for this session (not persisted)
+        self.build = None
+
+    @property
+    def files(self):
+        return self.images + self.documents
+
+    @property
+    def size(self) -> int:
+        total = 0
+        for path in self.files:
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+
+class SessionStore:
+    """
+    Bounded store of per-user sessions. Sessions idle longer than `ttl` seconds expire, at most
+    `max_sessions` are kept (least recently updated go first) and a session holds at most `max_files`
+    files totalling `max_bytes`.
+    Dropped sessions are passed to `on_evict(user_id, session)` so their files can be released.
+    With a Database, changed sessions are marked dirty and written to SQLite in one batch by
+    `flush()` (called off the event loop), so they survive a restart.
+    """
+
+    def __init__(self, ttl: float = 3600, max_sessions: int = 10000, max_files: int = 100,
+                 max_bytes: int = 200 * 1024 ** 2, on_evict=None, db=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.db = db
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        # user_id -> [files, bytes] held for downloads in flight, see reserve()
+        self._reserved = {}
+        # user_ids whose row must be rewritten (or deleted, if the session is gone) on the next flush
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+    def load(self):
+        """
+        Restore persisted sessions. Returns them as (user_id, session) pairs, e.g. to re-acquire their files.
+        """
+        if self.db is None:
+            return []
+        restored = []
+        with self._lock:
+            for user_id, images, documents, status_message_id, updated_at in self.db.select_sessions():
+                session = Session(json.loads(images), json.loads(documents), status_message_id, updated_at)
+                self._sessions[user_id] = session
+                restored.append((user_id, session))
+        return restored
+
+    def _mark(self, user_id):
+        if self.db is not None:
+            with self._lock:
+                self._dirty.add(user_id)
+
+    def flush(self) -> int:
+        """
+        Write dirty sessions to the database in one transaction. Blocking; run it in a thread.
+        Returns the number of rows written or deleted.
+        """
+        if self.db is None:
+            return 0
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows, deleted = [], []
+            for user_id in dirty:
+                session = self._sessions.get(user_id)
+                if session is None:
+                    deleted.append(user_id)
+                else:
+                    rows.append((user_id, json.dumps(session.images), json.dumps(session.documents),
+                                 session.status_message_id, int(session.updated)))
+        if not dirty:
+            return 0
+        try:
+            self.db.save_sessions(rows, deleted)
+        except Exception as e:
+            logging.error(f"Failed to persist {len(dirty)} sessions: {e}")
+            # Retried on the next flush
+            with self._lock:
+                self._dirty |= dirty
+            return 0
+        return len(dirty)
+
+    def get(self, user_id):
+        with self._lock:
+            return self._sessions.get(user_id)
+
+    def session(self, user_id) -> Session:
+        """
+        Return the user's session, creating it (and evicting the oldest one if full) when missing.
+        """
+        evicted = []
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = self._sessions[user_id] = Session()
+                while len(self._sessions) > self.max_sessions:
+                    evicted.append(self._sessions.popitem(last=False))
+            session.updated = time.time()
+            self._sessions.move_to_end(user_id)
+        self._evicted(evicted)
+        return session
+
+    def room(self, user_id):
+        """
+        How many more files and bytes the user's session can take, not counting reserved room.
+        """
+        with self._lock:
+            files, size = self._reserved.get(user_id, (0, 0))
+            session = self._sessions.get(user_id)
+            if session is not None:
+                files += len(session.files)
+                size += session.size
+            return self.max_files - files, self.max_bytes - size
+
+    def reserve(self, user_id, sizes) -> int:
+        """
+        Hold room for files about to be downloaded, so concurrent batches can't overfill the session.
+        Reserves the longest prefix of `sizes` that fits and returns its length; hand the same
+        sizes back to unreserve() once the downloads are done.
+        """
+        with self._lock:
+            files_left, bytes_left = self.room(user_id)
+            count = 0
+            for size in sizes:
+                if files_left < 1 or size > bytes_left:
+                    break
+                files_left -= 1
+                bytes_left -= size
+                count += 1
+            if count:
+                reserved = self._reserved.setdefault(user_id, [0, 0])
+                reserved[0] += count
+                reserved[1] += sum(sizes[:count])
+            return count
+
+    def unreserve(self, user_id, sizes):
+        with self._lock:
+            reserved = self._reserved.get(user_id)
+            if reserved is None:
+                return
+            reserved[0] -= len(sizes)
+            reserved[1] -= sum(sizes)
+            if reserved[0] <= 0:
+                del self._reserved[user_id]
+
+    def add_file(self, user_id, path: str, image: bool) -> bool:
+        """
+        Append a file to the session. Returns False if it does not fit in the session's limits.
+        """
+        with self._lock:
+            session = self.session(user_id)
+            files, size = self.room(user_id)
+            if files < 1 or os.path.getsize(path) > size:
+                return False
+            (session.images if image else session.documents).append(path)
+            self._mark(user_id)
+            return True
+
+    def take_images(self, user_id):
+        """
+        Remove and return the session's images (documents stay for a later ZIP).
+        """
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return []
+            images, session.images = session.images, []
+            self._mark(user_id)
+            return images
+
+    def take_files(self, user_id):
+        """
+        Remove and return all of the session's files as (images, documents).
+        """
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return [], []
+            images, documents = session.images, session.documents
+            session.images, session.documents = [], []
+            self._mark(user_id)
+            return images, documents
+
+    def restore_files(self, user_id, images=(), documents=()):
+        """
+        Put taken files back in front of the session, e.g. after a failed conversion. They were
+        admitted once already, so the limits are not checked again.
+        """
+        with self._lock:
+            session = self.session(user_id)
+            session.images[:0] = images
+            session.documents[:0] = documents
+            self._mark(user_id)
+
+    def set_status_message(self, user_id, message_id):
+        with self._lock:
+            session = self.session(user_id)
+            session.status_message_id = message_id
+            self._mark(user_id)
+
+    def clear_status_message(self, user_id):
+        # Once the status message is gone an empty session has nothing left to track
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return
+            session.status_message_id = None
+            if session.files or session.build is not None:
+                self._mark(user_id)
+            else:
+                del self._sessions[user_id]
+                self._mark(user_id)
+
+    def expire(self, now: float = None):
+        """
+        Evict sessions idle longer than the TTL. Returns how many were evicted.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            expired = [(user_id, session) for user_id, session in self._sessions.items()
+                       if now - session.updated > self.ttl]
+            for user_id, _ in expired:
+                del self._sessions[user_id]
+        self._evicted(expired)
+        return len(expired)
+
+    def _evicted(self, evicted):
+        for user_id, session in evicted:
+            self.evictions += 1
+            self._mark(user_id)
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(user_id, session)
+                except Exception as e:
+                    logging.error(f"Failed to clean up session of {user_id}: {e}")
+
+    def items(self):
+        with self._lock:
+            return list(self._sessions.items())
+
+    def __len__(self):
+        return len(self._sessions)
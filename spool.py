@@ -0,0 +1,83 @@
+import logging
+import os
+import shutil
+import time
+
+
+def disk_usage(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+class SpoolCollector:
+    """
+    Garbage collector for the documents/ spool. Each sweep removes job/build directories and stray
+    files older than `max_age` that nothing in this process is using, then evicts unreferenced blobs
+    (least recently used first) until the whole spool fits in `budget` bytes.
+    """
+
+    def __init__(self, root: str, blob_store, live_dirs, budget: int, max_age: float):
+        self.root = root
+        self.blob_store = blob_store
+        self.live_dirs = live_dirs
+        self.budget = budget
+        self.max_age = max_age
+        # Usage after the last sweep and the running total reclaimed, for the admin statistics
+        self.usage = 0
+        self.reclaimed = 0
+
+    def _remove(self, path: str) -> int:
+        try:
+            size = disk_usage(path)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            return size
+        except OSError as e:
+            logging.error(f"Failed to remove {path} from the spool: {e}")
+            return 0
+
+    def _sweep_orphans(self, directory: str, skip, now: float) -> int:
+        # Anything here is left over from a crash or an older version of the bot.
+        # Compared as absolute paths: mkdtemp() returns absolute ones on Python 3.12+
+        freed = 0
+        skip = {os.path.abspath(path) for path in skip}
+        live = {os.path.abspath(path) for path in list(self.live_dirs)}
+        for entry in os.scandir(directory):
+            path = os.path.abspath(entry.path)
+            if path in skip or path in live:
+                continue
+            if now - entry.stat().st_mtime > self.max_age:
+                freed += self._remove(entry.path)
+        return freed
+
+    def sweep(self) -> int:
+        """
+        Run one collection pass and return the bytes reclaimed.
+        """
+        now = time.time()
+        blobs_root = os.path.normpath(self.blob_store.root)
+        jobs_root = os.path.join(self.root, "jobs")
+        freed = self._sweep_orphans(self.root, {blobs_root, jobs_root}, now)
+        if os.path.isdir(jobs_root):
+            freed += self._sweep_orphans(jobs_root, (), now)
+
+        freed += self.blob_store.sweep_partial(self.max_age)
+
+        # Blobs are the only thing left to evict, so they get whatever budget the rest leaves
+        other = disk_usage(self.root) - self.blob_store.size
+        freed += self.blob_store.sweep(budget=self.budget - other, max_age=self.max_age)
+
+        self.usage = other + self.blob_store.size
+        self.reclaimed += freed
+        logging.info(f"Spool sweep reclaimed {freed} bytes, {self.usage} bytes in use")
+        return freed
@@ -0,0 +1,98 @@
+import os
+import random
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+from pypdf import PdfReader
+
+import convert
+from convert import IncrementalBuild, convert_to_pdf, create_zip
+
+
+@pytest.fixture
+def images(tmp_path):
+    # One of each path through prepare_page: RGB and grayscale JPEGs are passed through,
+    # PNG with alpha and CMYK JPEG are re-encoded
+    paths = []
+    for name, mode, size in (("rgb.jpg", "RGB", (64, 48)), ("gray.jpg", "L", (30, 90)),
+                             ("alpha.png", "RGBA", (50, 50)), ("cmyk.jpg", "CMYK", (40, 20))):
+        path = tmp_path / name
+        Image.new(mode, size, color=(10, 20, 30, 40)[:len(mode)]).save(path)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def documents(tmp_path, images):
+    # Deflated text, an already-compressed file that is stored, and incompressible bytes
+    text = tmp_path / "notes.txt"
+    text.write_text("salom dunyo\n" * 5000)
+    noise = tmp_path / "noise.bin"
+    noise.write_bytes(random.Random(0).randbytes(300 * 1024))
+    return [str(text), images[0], str(noise)]
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+def test_pdf_opens_in_strict_mode(images, tmp_path):
+    output = convert_to_pdf(images, str(tmp_path / "out.pdf"), dpi=72)
+    reader = PdfReader(output, strict=True)
+    assert len(reader.pages) == len(images)
+    for page, path in zip(reader.pages, images):
+        with Image.open(path) as image:
+            assert (float(page.mediabox.width), float(page.mediabox.height)) == pytest.approx(image.size, abs=0.01)
+
+
+def test_incremental_pdf_matches_batch(images, tmp_path, executor):
+    batch = convert_to_pdf(images, str(tmp_path / "batch.pdf"))
+    build = IncrementalBuild(executor, root=str(tmp_path / "jobs"))
+    try:
+        for path in images:
+            build.add_image(path)
+        incremental = build.finish_pdf()
+        with open(batch, "rb") as expected, open(incremental, "rb") as actual:
+            assert actual.read() == expected.read()
+    finally:
+        build.discard()
+    assert not os.path.exists(build.dir)
+
+
+def check_zip(path, sources):
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [os.path.basename(source) for source in sources]
+        for source in sources:
+            with open(source, "rb") as expected:
+                assert archive.read(os.path.basename(source)) == expected.read()
+
+
+def test_zip_is_readable(documents, tmp_path):
+    check_zip(create_zip(documents, str(tmp_path / "out.zip")), documents)
+
+
+def test_zip64_is_readable(documents, tmp_path, monkeypatch):
+    # Every size and offset past the limit, so all ZIP64 records and extra fields are written
+    monkeypatch.setattr(convert, "ZIP64_LIMIT", 16)
+    output = create_zip(documents, str(tmp_path / "out.zip"))
+    with open(output, "rb") as archive:
+        assert b"PK\x06\x06" in archive.read()
+    check_zip(output, documents)
+
+
+def test_incremental_zip_matches_batch(documents, tmp_path, executor):
+    batch = create_zip(documents, str(tmp_path / "batch.zip"))
+    build = IncrementalBuild(executor, root=str(tmp_path / "jobs"))
+    try:
+        for path in documents:
+            build.add_document(path)
+        incremental = build.finish_zip()
+        with open(batch, "rb") as expected, open(incremental, "rb") as actual:
+            assert actual.read() == expected.read()
+    finally:
+        build.discard()